@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# collector-check.py [minutes]
+# Checks that the gaps in a lesson being written to an
+# outputFile stay cheap however long they are: writes
+# 1 minute and then 'minutes' minutes (default 30) of
+# silence, with and without beeps, to a temporary raw
+# file, and reports how many processes (sox etc) were
+# started and the peak memory allocated (the latter needs
+# Python 3.4 or above).  Exits with an error if a long
+# gap costs more than a short one.
+
+# Run in the same directory as gradint.py with all the
+# settings.  Requires sox.
+
+import sys,os
+minutes = 30
+if sys.argv[1:]: minutes = float(sys.argv[1])
+outFile = "collector-check.raw"
+sys.argv = sys.argv[:1]+["outputFile='"+outFile+"'"]
+import gradint
+
+processes = [0]
+def counted(f):
+    def c(*args,**kwargs):
+        processes[0] += 1
+        return f(*args,**kwargs)
+    return c
+os.system,os.popen = counted(os.system),counted(os.popen)
+try: import tracemalloc
+except ImportError: tracemalloc = None
+
+def measure(seconds,beeps):
+    # Returns (processes started, peak bytes allocated or None) for writing 'seconds' of silence
+    c = gradint.SoundCollector()
+    processes[0] = 0
+    if tracemalloc: tracemalloc.start()
+    c.addSilence(seconds,beeps)
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    c.o.close()
+    return processes[0],peak
+
+gradint.soundCollector.o.close() # (we'll make our own)
+gradint.beepThreshold = 20
+ok = 1
+try:
+    for beeps in [0,1]:
+        short = measure(60,beeps)
+        longer = measure(minutes*60,beeps)
+        for secs,(procs,peak) in [(60,short),(minutes*60,longer)]:
+            if peak==None: peak = "unknown"
+            else: peak = "%.2fM" % (peak/1048576.0)
+            print ("%g minutes of silence%s: %d processes, peak allocation %s" % (secs/60.0,gradint.cond(beeps," with beeps",""),procs,peak))
+        if longer[0] > short[0] or (tracemalloc and longer[1] > 2*short[1]+65536):
+            print ("FAILED: the longer silence cost more")
+            ok = 0
+finally: os.remove(outFile)
+if ok: print ("OK")
+else: sys.exit(1)
@@ -34,7 +34,7 @@ newProg = gradint.ProgressDatabase(alsoScan=0)
 gradint.mergeProgress(newProg.data,mergeIn)
 del mergeIn
 changes = [] ; count=0
-gradint.sort(newProg.data,gradint.cmpfunc)
+gradint.sortByKey(newProg.data,gradint.cmpkey)
 for tries,l1,l2 in newProg.data:
   if not tries: continue
   key = gradint.norm_filelist(l1,l2)
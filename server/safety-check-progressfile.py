@@ -32,6 +32,11 @@
 # cannot be changed between being validated by
 # this script and being used by Gradint.
 
+# (Newer versions of Gradint read progress.txt
+# with a parser that accepts only data, not code,
+# unless Python's re module is missing, so this
+# check is now needed only for older versions.)
+
 from gradint import ProgressDatabase, progressFile
 from os import popen
 try: f=popen("gzip -fdc \""+progressFile+"\"").read()
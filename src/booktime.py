@@ -23,14 +23,92 @@
 
 def initialGlue(): return Glue(0,maxLenOfLesson)
 
-try: from bisect import insort
+try: from bisect import insort,bisect_left,bisect_right
 except:
-    def insort(l,item):
-        l.append(item) ; l.sort()
+    def bisect_left(l,item):
+        lo,hi = 0,len(l)
+        while lo<hi:
+            mid = (lo+hi)//2
+            if l[mid]<item: lo=mid+1
+            else: hi=mid
+        return lo
+    def bisect_right(l,item):
+        lo,hi = 0,len(l)
+        while lo<hi:
+            mid = (lo+hi)//2
+            if item<l[mid]: hi=mid
+            else: lo=mid+1
+        return lo
+    def insort(l,item): l.insert(bisect_right(l,item),item)
 class Schedule(object):
-    # A sorted list of (start,finish) times that are booked
-    def __init__(self): self.bookedList = []
-    def book(self,start,finish): insort(self.bookedList,(start,finish))
+    # A sorted list of (start,finish) times that are booked,
+    # plus an index of "blocks" (runs of booked time with
+    # no gap in between) and of the gaps between them, so
+    # overlaps() can bisect instead of scanning the list.
+    # Costs: a booking that only extends an existing block
+    # updates the gap tree in O(log n); one that adds or
+    # merges blocks shifts the gap indices, so the tree is
+    # rebuilt (O(n)) the next time overlaps() needs it.
+    # bookedList.insert is O(n) as well (but it's a memmove).
+    def __init__(self):
+        self.bookedList = []
+        self.blockStarts,self.blockEnds = [],[]
+        self.gapTree = None # max-tree of the gaps between blocks, built when needed
+        self.nested = 0 # set if one booking is inside another, in which case overlaps() falls back to scanning bookedList
+    def book(self,start,finish):
+        i = bisect_right(self.bookedList,(start,finish))
+        self.bookedList.insert(i,(start,finish))
+        if (i and self.bookedList[i-1][1]>finish) or (i+1<len(self.bookedList) and self.bookedList[i+1][1]<finish): self.nested = 1
+        j = k = bisect_left(self.blockEnds,start) # first block that finishes as or after we start
+        while k<len(self.blockStarts) and self.blockStarts[k]<=finish: k += 1
+        if k>j: start,finish = min(start,self.blockStarts[j]),max(finish,self.blockEnds[k-1])
+        self.blockStarts[j:k] = [start] ; self.blockEnds[j:k] = [finish]
+        if k==j+1 and self.gapTree: # same blocks, just block j is wider: update the gaps either side of it
+            self.setGap(j-1) ; self.setGap(j)
+        else: self.gapTree = None
+    def setGap(self,i):
+        size,tree = self.gapTree
+        if i<0 or i>=len(self.blockStarts)-1: return
+        n = size+i ; tree[n] = self.blockStarts[i+1]-self.blockEnds[i]
+        while n > 1:
+            n >>= 1 ; m = max(tree[2*n],tree[2*n+1])
+            if tree[n]==m: break
+            tree[n] = m
+    def makeGapTree(self):
+        # gap i is between block i and block i+1; leaf i of the tree is at size+i, and node n is the max of nodes 2n and 2n+1
+        nGaps = len(self.blockStarts)-1 ; size = 1
+        while size < nGaps: size *= 2
+        tree = [-1]*size + [self.blockStarts[i+1]-self.blockEnds[i] for i in xrange(nGaps)] + [-1]*(size-nGaps)
+        for n in xrange(size-1,0,-1): tree[n] = max(tree[2*n],tree[2*n+1])
+        self.gapTree = (size,tree)
+    def nextWideGap(self,i,minGap):
+        # Returns the first gap index >= i whose gap is >= minGap, or the number of blocks - 1 if there isn't one
+        if self.gapTree==None: self.makeGapTree()
+        size,tree = self.gapTree ; nGaps = len(self.blockStarts)-1
+        if i >= nGaps: return nGaps
+        n = size+i
+        while tree[n] < minGap: # move to the next subtree to the right
+            while n & 1: n >>= 1
+            if not n: return nGaps
+            n += 1
+        while n < size: # then find its leftmost wide-enough leaf
+            n *= 2
+            if tree[n] < minGap: n += 1
+        return n-size
+    def prevWideGap(self,i,minGap):
+        # Returns the last gap index <= i whose gap is >= minGap, or -1 if there isn't one
+        if self.gapTree==None: self.makeGapTree()
+        size,tree = self.gapTree
+        if i < 0: return -1
+        n = size+min(i,len(self.blockStarts)-2)
+        while tree[n] < minGap: # move to the next subtree to the left
+            while n>1 and not n & 1: n >>= 1
+            if n<=1: return -1
+            n -= 1
+        while n < size:
+            n = n*2+1
+            if tree[n] < minGap: n -= 1
+        return n-size
 
 earliestAllowedEvent = 0 # for "don't start before" hacks, so can keep all initial glue starting at 0
 
@@ -58,23 +136,41 @@ class GlueOrEvent(object):
         oldStart = start
         if direction==1: # moving forwards
             start = max(start,earliestAllowedEvent)
-            count = 0 ; blLen = len(schedule.bookedList)
-            while count<blLen and schedule.bookedList[count][1] <= start: # finishes before or as we start - irrelevant
-                count += 1
-            while count<blLen and schedule.bookedList[count][0]<start+self.length: # starts before we finish
-                start = schedule.bookedList[count][1]
+            if self.length<=0 or schedule.nested: return self.overlaps_scan(start,schedule,direction)-oldStart
+            starts,ends = schedule.blockStarts,schedule.blockEnds
+            count = bisect_right(ends,start) # blocks that finish before or as we start are irrelevant
+            while count<len(starts) and starts[count]<start+self.length: # starts before we finish
+                # skip to the first gap we might fit in (minGap is slightly under our length in case of rounding, and the loop condition re-checks exactly)
+                count = schedule.nextWideGap(count,self.length-1e-6)
+                start = ends[count]
                 count += 1
             return start-oldStart
         else: # moving backwards
             if start<earliestAllowedEvent: return oldStart+1 # hack: force being placed before the beginning of the lesson, which should result in rejecting it
+            if self.length<=0 or schedule.nested: return oldStart-self.overlaps_scan(start,schedule,direction)
+            starts,ends = schedule.blockStarts,schedule.blockEnds
+            count = bisect_left(starts,start+self.length)-1 # blocks that start after or as we finish are irrelevant
+            while count>=0 and ends[count]>start: # finishes after we start
+                count = schedule.prevWideGap(count-1,self.length-1e-6)+1 # (as above)
+                start = starts[count]-self.length
+                count -= 1
+            return oldStart-start
+    def overlaps_scan(self,start,schedule,direction):
+        # Returns the new start by scanning schedule.bookedList one booking at a time (the original algorithm, which overlaps() uses when the block index would not give exactly the same answer)
+        if direction==1:
+            count = 0 ; blLen = len(schedule.bookedList)
+            while count<blLen and schedule.bookedList[count][1] <= start: count += 1
+            while count<blLen and schedule.bookedList[count][0]<start+self.length:
+                start = schedule.bookedList[count][1]
+                count += 1
+        else:
             count = len(schedule.bookedList)-1
             finish=start+self.length
-            while count>=0 and schedule.bookedList[count][0] >= finish: # starts after or as we finish - irrelevant
-                count -= 1
-            while count>=0 and schedule.bookedList[count][1]>start: # finishes after we start
+            while count>=0 and schedule.bookedList[count][0] >= finish: count -= 1
+            while count>=0 and schedule.bookedList[count][1]>start:
                 start = schedule.bookedList[count][0]-self.length
                 count -= 1
-            return oldStart-start
+        return start
     def will_be_played(self): pass
     def play(self): pass
     def setOnLeaves(self,name,value):
@@ -165,19 +261,40 @@ class GluedEvent(object):
     def setOnLeaves(self,name,value): self.event.setOnLeaves(name,value)
     def setOnLastLeaf(self,name,value): self.event.setOnLastLeaf(name,value)
 
-def setGlue(gluedEventList, schedule, glueStart = 0):
-    # Uses tail recursion / backtracking with exceptions
-    # (Note: can throw an exception to outermost level if
-    # there is no solution)
-    if not gluedEventList: return
-    try:
-        if gluedEventList[0].glue.preAdjustment==None: gluedEventList[0].randomPreAdjustment() # (Do NOT re-do on backtrack: should find a fit regardless of the pre-adjustment)
-        gluedEventList[0].adjustGlue(glueStart,schedule,1)
-        setGlue(gluedEventList[1:],schedule,gluedEventList[0].getAdjustedEnd(glueStart))
-    except StretchedTooFar:
-        if glueStart==0: raise StretchedTooFar # don't even try pushing it the other way (NB randomPreAdjustment will be 0 for the initial glue)
-        gluedEventList[0].adjustGlue(glueStart,schedule,-1)
-        setGlue(gluedEventList[1:],schedule,gluedEventList[0].getAdjustedEnd(glueStart))
+def setGlue(gluedEventList, schedule, glueStart = 0, failed = None):
+    # "First fit" each event in turn, backtracking to try
+    # an earlier event backwards if a later one can't fit
+    # (Note: throws StretchedTooFar if there is no solution)
+    # 'failed' can be a dictionary of (index,glueStart) that
+    # are known to have no solution on this schedule (not
+    # including index 0, as its glue can change); it's
+    # added to as we go.
+    n = len(gluedEventList)
+    if failed==None: failed = {}
+    starts = [glueStart]*(n+1) # glueStart of each event
+    backwards = [0]*n # 1 if we're now trying to move it backwards
+    i = 0
+    while i < n:
+        e = gluedEventList[i]
+        if i and not backwards[i] and checkIn((i,starts[i]),failed): giveUp = 1
+        else:
+            if e.glue.preAdjustment==None: e.randomPreAdjustment() # (Do NOT re-do on backtrack: should find a fit regardless of the pre-adjustment)
+            try:
+                e.adjustGlue(starts[i],schedule,1-2*backwards[i])
+                starts[i+1] = e.getAdjustedEnd(starts[i])
+                i += 1
+                if i < n: backwards[i] = 0
+                continue
+            except StretchedTooFar: giveUp = backwards[i] or starts[i]==0 # don't even try pushing it the other way if glueStart==0 (NB randomPreAdjustment will be 0 for the initial glue)
+        if not giveUp:
+            backwards[i] = 1 ; continue
+        # no solution from this event's glueStart: go back to the last event we haven't yet tried backwards
+        while 1:
+            if i: failed[(i,starts[i])] = 1
+            i -= 1
+            if i < 0: raise StretchedTooFar()
+            if not backwards[i] and not starts[i]==0: break
+        backwards[i] = 1
 
 def setGlue_wrapper(gluedEventList, schedule):
     # Normally setGlue will do "first fit" and will throw
@@ -188,11 +305,14 @@ def setGlue_wrapper(gluedEventList, schedule):
     # gluedEventList[0].glue.length should be 0 but we can increase it here (only).
     if len(gluedEventList)==1: return setGlue(gluedEventList,schedule) # no point doing the stuff below on length-1 lists
     worked = 0
+    failed = {} # shared between tries, as later events often end up at the same place as in a previous try
     while (not worked) and gluedEventList[0].glue.length < maxLenOfLesson:
         try:
-            setGlue(gluedEventList, schedule)
+            setGlue(gluedEventList, schedule, 0, failed)
             worked = 1
         except StretchedTooFar:
+            g = gluedEventList[0]
+            if g.glue.length+g.event.overlaps(g.glue.length,schedule,1)+g.event.length > maxLenOfLesson: break # first event can't fit before the end of the lesson now, so it won't with any more glue either (it never goes backwards)
             # try harder
             gluedEventList[0].glue.length += (10+gluedEventList[0].glue.adjustment) # (NB preAdjustment will be 0, so don't have to worry about that)
             # (TODO the 10 should be a constant)
@@ -289,17 +409,25 @@ class Lesson(object):
         global copy_of_runner_events ; copy_of_runner_events = []
         global lessonStartTime ; lessonStartTime = 0 # will be set to time.time() on 1st event
         disable_lid(0)
+        finished = 0
         try:
-          # make the runner as late as possible
-          if soundCollector: runner = sched.scheduler(collector_time,collector_sleep)
-          else: runner = sched.scheduler(time.time,mysleep)
-          for (t,event) in self.events: copy_of_runner_events.append((event,runner.enter(t,1,play,(event,)),t))
-          # TODO what if Brief Interrupt appears during that events loop and someone presses it (will act as a Cancel and go back to main)
-          try: runner.run()
-          except KeyboardInterrupt: handleInterrupt()
-        finally: disable_lid(1)
-        runner = None
-        if soundCollector: soundCollector.finished()
+          try:
+            # make the runner as late as possible
+            if soundCollector: runner = sched.scheduler(collector_time,collector_sleep)
+            else: runner = sched.scheduler(time.time,mysleep)
+            for (t,event) in self.events: copy_of_runner_events.append((event,runner.enter(t,1,play,(event,)),t))
+            # TODO what if Brief Interrupt appears during that events loop and someone presses it (will act as a Cancel and go back to main)
+            try: runner.run()
+            except KeyboardInterrupt: handleInterrupt()
+          finally: disable_lid(1)
+          runner = None
+          if soundCollector: soundCollector.finished()
+          finished = 1
+        finally:
+          if soundCollector and not finished: soundCollector.abort() # (an exception is on its way out, so the rest of the lesson won't be written: don't leave the collector's writer and encoder waiting for it)
+        if thePcmCache:
+            if not app: thePcmCache.report()
+            thePcmCache.save()
         if logFileHandle: logFileHandle.close()
 
 subst_synth_counters = {} # global so it carries over when using justSynthesize in repeat mode
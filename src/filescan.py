@@ -19,7 +19,7 @@ def init_scanSamples():
   singleLinePoems = {} # keys are any poem files which are single line only, so as to avoid saying 'beginning' in prompts
   variantFiles = {} # maps dir+fname to (no dir+) fname list, main use is in fileToEvent.  Careful with clearing this if prompts is using it also (hence init_scanSamples is called only below and in loop.py before prompt scan)
 init_scanSamples() ; emptyCheck_hack = 0
-def scanSamples(directory=None):
+def scanSamples(directory=None,sink=None):
     if not directory: directory=samplesDirectory
     # Scans the samples directory for pairs of
     # files like someword_zh.wav, someword_en.wav
@@ -28,13 +28,26 @@ def scanSamples(directory=None):
     # (Note: Rest of program now also supports LISTS of
     # files to use for a given "word" - currently used in
     # poetry learning)
-    retVal = []
+    # Returns a list of (0,prompt,response), or if sink is
+    # given, passes them to sink.append() and returns sink
+    # (so a consumer like ProgressMerger can process them
+    # as they're found, and no list need be kept)
+    wait_for_preplan()
+    if sink==None: retVal = []
+    else: retVal = sink
     if not emptyCheck_hack: doLabel("Scanning samples")
     if import_recordings_from: import_recordings()
-    scanSamples_inner(directory,retVal,0)
+    global dirPrefetcher
+    if scan_threads and thread and hasattr(os,"scandir"): dirPrefetcher = DirPrefetcher(scan_threads)
+    try: scanSamples_inner(directory,retVal,0)
+    finally:
+        if dirPrefetcher: dirPrefetcher.stop()
+        dirPrefetcher = None
+    if not emptyCheck_hack: save_dirManifest(directory)
     return retVal
 
 def words_exist(): # for GUI (but do NOT call from GUI thread)
+  wait_for_preplan() # (before setting emptyCheck_hack)
   global emptyCheck_hack ; emptyCheck_hack = 1
   r = scanSamples() or parseSynthVocab(vocabFile)
   emptyCheck_hack = 0
@@ -91,6 +104,123 @@ def check_has_variants(directory,ls):
         for file in ls:
             if (file+extsep)[:file.rfind(extsep)]==variants_filename: return True
 
+# Directory manifest: scanning a large collection (especially over a network filesystem) spends most of its time listing directories and checking which entries are subdirectories.  So keep each directory's listing, and the isDirectory results getLsDic needed, keyed by the directory's mtime (which changes whenever an entry is added, removed or renamed), and keep it between runs.  getLsDic still does all its other processing (which can depend on synth settings, .txt contents etc) on the listing, so the result is the same as a full scan.
+dirManifest_file = "dir-manifest"+extsep+"bin"
+dirManifestFormat = (1,sys.version_info[0]) # increment if the format of the values changes (and Python 2 and 3 listings differ)
+dirManifest = {} ; dirManifest_changed = 0 ; dirManifest_used = {}
+if pickle and fileExists(dirManifest_file):
+    try:
+        format,values = pickle.Unpickler(open(dirManifest_file,"rb")).load()
+        if format==dirManifestFormat: dirManifest = values
+        del format,values
+    except MemoryError: raise
+    except: pass # just list them again
+def read_directory(directory,path=None):
+    # The filesystem part of manifest_listdir (may be run in a DirPrefetcher thread, in which case path is directory made absolute, since synth etc may chdir meanwhile).  Returns (mtime,listing,isDirectory results), or (mtime,None,None) if the manifest's listing is still current.
+    if not path: path = directory
+    try: mtime = os.stat(path).st_mtime
+    except: mtime = None
+    r = dirManifest.get(directory,None)
+    if mtime and r and r[0]==mtime: return mtime,None,None
+    isDir = {}
+    if hasattr(os,"scandir") and not use_unicode_filenames: # DirEntry can usually say which entries are directories without a stat each
+        ls = [] ; it = os.scandir(path)
+        for e in it:
+            ls.append(e.name) ; f = e.name.lower()
+            if not (f.endswith(dotwav) or f.endswith(dotmp3)): # (getLsDic doesn't need to know for these)
+                try: isDir[e.name] = e.is_dir()
+                except OSError: pass
+        if hasattr(it,"close"): it.close()
+    else: ls = os.listdir(path)
+    return mtime,ls,isDir
+def manifest_listdir(directory):
+    # returns (os.listdir(directory),dict of isDirectory results for its entries), or raises OSError like os.listdir
+    global dirManifest_changed
+    dirManifest_used[directory] = 1
+    r = None
+    if dirPrefetcher: r = dirPrefetcher.get(directory)
+    if not r: r = read_directory(directory)
+    mtime,ls,isDir = r
+    if ls==None:
+        r = dirManifest[directory] ; ls,isDir = r[1][:],r[2]
+    elif mtime and mtime < time.time()-2: # (not if it's only just changed: another change within the mtime's resolution might not alter it)
+        dirManifest[directory] = (mtime,ls[:],isDir)
+        dirManifest_changed = 1
+    elif checkIn(directory,dirManifest): del dirManifest[directory]
+    if dirPrefetcher: # start listing its subdirectories while we process this one
+        subdirs = filter(lambda f,isDir=isDir:isDir.get(f,0) and f.find(exclude_from_scan)==-1, ls) ; subdirs.sort()
+        for f in subdirs: dirPrefetcher.add(directory+os.sep+f)
+    return ls,isDir
+def manifest_isDirectory(directory,file,isDir):
+    global dirManifest_changed
+    if not checkIn(file,isDir):
+        isDir[file] = isDirectory(directory+os.sep+file)
+        dirManifest_changed = 1
+    return isDir[file]
+dirPrefetcher = None
+class DirPrefetcher(object):
+    # Lists directories (read_directory) in up to numThreads
+    # background threads, ahead of scanSamples_inner getting
+    # to them, so that on a high-latency filesystem sibling
+    # subtrees are listed concurrently.  The results are
+    # still processed one at a time in the usual order, so
+    # they (and the random number sequence) don't depend on
+    # which listing finishes first.
+    def __init__(self,numThreads):
+        self.lock = thread.allocate_lock()
+        self.jobs = {} # directory -> [lock released when done, result, absolute path]
+        self.todo = [] ; self.maxThreads,self.threads = numThreads,0
+    def add(self,directory):
+        self.lock.acquire()
+        if not checkIn(directory,self.jobs):
+            done = thread.allocate_lock() ; done.acquire()
+            self.jobs[directory] = [done,None,os.path.abspath(directory)]
+            self.todo.append(directory)
+            if self.threads < self.maxThreads:
+                self.threads += 1 ; thread.start_new_thread(self.worker,())
+        self.lock.release()
+    def worker(self):
+        while True:
+            self.lock.acquire()
+            if not self.todo:
+                self.threads -= 1 ; self.lock.release() ; return
+            directory = self.todo.pop(0) ; job = self.jobs[directory]
+            self.lock.release()
+            self.run(directory,job)
+    def run(self,directory,job):
+        try: job[1] = read_directory(directory,job[2])
+        except: job[1] = sys.exc_info()[1]
+        job[0].release()
+    def get(self,directory):
+        # returns read_directory(directory)'s result, or None if it wasn't added
+        self.lock.acquire()
+        job = self.jobs.get(directory,None)
+        if job and checkIn(directory,self.todo): # not started yet, so do it now
+            self.todo.remove(directory) ; startNow = 1
+        else: startNow = 0
+        self.lock.release()
+        if not job: return None
+        if startNow: self.run(directory,job)
+        job[0].acquire()
+        self.lock.acquire() ; del self.jobs[directory] ; self.lock.release()
+        if isinstance(job[1],Exception): raise job[1]
+        return job[1]
+    def stop(self): # (threads will finish what they're doing and exit; results no longer needed)
+        self.lock.acquire() ; self.todo = [] ; self.lock.release()
+
+def save_dirManifest(scannedDir):
+    global dirManifest_changed
+    for k in list(dirManifest.keys()):
+        if (k==scannedDir or k.startswith(scannedDir+os.sep)) and not checkIn(k,dirManifest_used): # not found in this scan, so no longer exists
+            del dirManifest[k] ; dirManifest_changed = 1
+    if not dirManifest_changed or not pickle: return
+    try:
+        f = SaveFile(dirManifest_file) # (so an interrupted or concurrent save can't leave it truncated)
+        pickle.Pickler(f,-1).dump((dirManifestFormat,dirManifest)) ; f.close()
+    except IOError: pass # ignore write errors as it's only a cache
+    except OSError: pass
+    dirManifest_changed = 0
+
 # TODO can we make it so samples like ".wav.mp3" (lame's default o/p naming convention) work?  They already work if !variants is set and it's lang_zh_variant, because the .wav is then interpreted as part of the variant name.  Otherwise .wav is interpreted as part of the language name so file will be ignored.
 
 def getLsDic(directory):
@@ -99,7 +229,7 @@ def getLsDic(directory):
     # Puts variants into variantFiles and normalises them
     # Also sorts out import_recordings output (pointless for prompts, but settings.txt shouldn't be found in prompts)
     if not (directory.find(exclude_from_scan)==-1): return {}
-    try: ls = os.listdir(directory)
+    try: ls,isDir = manifest_listdir(directory)
     except: return {} # (can run without a 'samples' directory at all if just doing synth)
     if checkIn("settings"+dottxt,ls):
         # Sort out the o/p from import_recordings (and legacy record-with-HDogg.bat if anyone's still using that)
@@ -114,7 +244,7 @@ def getLsDic(directory):
             if not num: continue # no number to adjust
             os.rename(directory+os.sep+f,directory+os.sep+f[:i]+(("%0"+str(len(str(len(ls))))+"d") % (int((int(num)-1)/2)*2+1))+cond(int(num)%2,oddLanguage,evenLanguage)+f[f.rfind(extsep):])
         os.remove(directory+os.sep+"settings"+dottxt)
-        ls = os.listdir(directory)
+        ls,isDir = manifest_listdir(directory)
     ls.sort()
     lsDic = {} # key is file w/out extension but INCLUDING any variant number.  Value is full filename if it's an extension we know about, "" if it's a file we can't process, or None if it's a directory (in which case key includes any 'extension' if the directory has one)
     has_variants = check_has_variants(directory,ls)
@@ -127,7 +257,7 @@ def getLsDic(directory):
         else:
             val = ""
             if filelower.endswith(extsep+"zip"): show_warning("Warning: Ignoring "+file+" (please unpack it first)") # so you can send someone a zip file for their recorded words folder and they'll know what's up if they don't unpack it
-            elif isDirectory(directory+os.sep+file):
+            elif manifest_isDirectory(directory,file,isDir):
                 lsDic[file]=None # a directory: store full name even if it has extsep in it.  Note however that we don't check isDirectory() if it's .wav etc as that would take too long.  (however some dirnames can contain dots)
                 # (+ NB need to store the directories specifically due to cases like course/ and course.pdf which may otherwise result in 2 traversals of "course" if we check isDirectory on 'extension is either none or unknown')
                 continue
@@ -252,16 +382,91 @@ def scanSamples_inner(directory,retVal,doLimit):
             lastFile = [promptFile,withExt]
 
 cache_maintenance_mode=0 # hack so cache-synth.py etc can cache promptless words for use in justSynthesize, and words in prompts themselves
-def parseSynthVocab(fname,forGUI=0):
-    if not fname: return []
-    langs = [secondLanguage,firstLanguage] ; someLangsUnknown = 0 ; maxsplit = 1
-    ret = []
-    count = 1 ; doLimit = 0 ; limitNo = 0 ; doPoetry = disablePoem = 0
-    lastPromptAndWord = None
-    if not fileExists(fname): return []
+# Compiled vocab cache: parsing a large vocab file (and checking each word can be synthesized) is slow on low-end devices, so keep the result of the last parse, keyed by the file's size and mtime and the settings the parse depends on.  It's used only if every language the file mentions has a synth, since otherwise can_be_synthesized looks in synthCache and partials word by word.  If the file has only been appended to since (as the GUI's "add word" does), just the new lines are parsed, continuing from the parser state saved at the end of the old ones.  Each vocab file has its own cache file next to it (one for the lesson parse and one for the GUI's), holding only the latest parse, so it doesn't grow and processes using different vocab files don't overwrite each other's entries.
+vocabCacheFormat = (2,sys.version_info[0])
+def vocabCache_file(fname,forGUI): return fname+cond(forGUI,"-guicache","-cache")
+def vocabCache_settings(forGUI): return (forGUI,firstLanguage,secondLanguage,tuple(otherLanguages),tuple(otherFirstLanguages),cache_maintenance_mode)
+def load_vocabCache(fname,forGUI): # (it's loaded for each parse, not kept in memory)
+    cFile = vocabCache_file(fname,forGUI)
+    if pickle and fileExists(cFile):
+        try:
+            format,entry = pickle.Unpickler(open(cFile,"rb")).load()
+            if format==vocabCacheFormat: return entry
+        except MemoryError: raise
+        except: pass # just parse again
+def save_vocabCache(fname,forGUI,entry):
+    if not pickle: return
+    try:
+        f = SaveFile(vocabCache_file(fname,forGUI))
+        pickle.Pickler(f,-1).dump((vocabCacheFormat,entry)) ; f.close()
+    except IOError: pass # ignore write errors as it's only a cache
+    except OSError: pass
+def all_have_synths(langs):
+    for l in langs:
+        if not get_synth_if_possible(l,0): return False
+    return True
+def dict_changes(before,after): # returns (items added or changed, keys deleted)
+    changed = {}
+    for k,v in after.items():
+        if not checkIn(k,before) or not before[k]==v: changed[k]=v
+    return changed,filter(lambda k,after=after:not checkIn(k,after),before.keys())
+def merge_changes(old,new):
+    changed,deleted = old[0].copy(),old[1]+new[1]
+    for k in new[1]:
+        if checkIn(k,changed): del changed[k]
+    changed.update(new[0]) ; return changed,deleted
+def apply_changes(d,changes):
+    for k in changes[1]:
+        if checkIn(k,d): del d[k]
+    d.update(changes[0])
+
+def parseSynthVocab(fname,forGUI=0,sink=None):
+    # Returns a list of (0,prompt,response) for the vocab file.  If sink is given, the entries are instead append()ed to it, and sink is returned (see scanSamples).
+    wait_for_preplan()
+    if sink==None: sink = []
+    if not fname: return sink
+    if not fileExists(fname): return sink
     if not emptyCheck_hack: doLabel("Reading "+fname)
+    c = load_vocabCache(fname,forGUI)
+    try: st = os.stat(fname) ; size,mtime = st.st_size,st.st_mtime
+    except OSError: size = mtime = None
+    if c and not (c["settings"]==vocabCache_settings(forGUI) and all_have_synths(c["langs"].keys())): c = None
+    if c and (c["size"],c["mtime"])==(size,mtime):
+        apply_changes(singleLinePoems,c["singleLinePoems"]) ; apply_changes(limitedFiles,c["limitedFiles"])
+        return extend_sink(sink,c["ret"])
+    data = read(fname)
+    oldSLP,oldLF = singleLinePoems.copy(),limitedFiles.copy()
+    if c and c["parsedLen"] and len(data)>c["parsedLen"] and zlib and zlib.crc32(data[:c["parsedLen"]])==c["crc"] and not emptyCheck_hack: # only appended to since
+        apply_changes(singleLinePoems,c["singleLinePoems"]) ; apply_changes(limitedFiles,c["limitedFiles"])
+        oldSLP2,oldLF2 = singleLinePoems.copy(),limitedFiles.copy()
+        ret,state,langs = c["ret"],c["state"][:],c["langs"].copy()
+        parseSynthVocab_lines(data[c["parsedLen"]:],forGUI,state,ret,langs)
+        slpChanges = merge_changes(c["singleLinePoems"],dict_changes(oldSLP2,singleLinePoems))
+        lfChanges = merge_changes(c["limitedFiles"],dict_changes(oldLF2,limitedFiles))
+    else:
+        ret,state = [],[[secondLanguage,firstLanguage],0,1,1,0,0,0,0,None]
+        langs = list2dict(state[0])
+        parseSynthVocab_lines(u8strip(data),forGUI,state,ret,langs)
+        if emptyCheck_hack: return extend_sink(sink,ret)
+        slpChanges,lfChanges = dict_changes(oldSLP,singleLinePoems),dict_changes(oldLF,limitedFiles)
+    if size==len(data) and all_have_synths(langs.keys()):
+        parsedLen = max(data.rfind(B("\n")),data.rfind(B("\r")))+1
+        if not parsedLen==len(data) or not zlib: parsedLen = 0 # last line not finished, so can't continue from here
+        save_vocabCache(fname,forGUI,{"settings":vocabCache_settings(forGUI),"langs":langs,"size":size,"mtime":mtime,"ret":ret,"state":state,"parsedLen":parsedLen,"crc":cond(parsedLen,zlib and zlib.crc32(data),0),"singleLinePoems":slpChanges,"limitedFiles":lfChanges})
+    del c,data
+    return extend_sink(sink,ret)
+def extend_sink(sink,l):
+    if type(sink)==type([]): sink += l
+    else:
+        append = sink.append
+        for i in l: append(i)
+    return sink
+
+def parseSynthVocab_lines(data,forGUI,state,ret,seenLangs):
+    # Parses the vocab lines in data, appending to ret.  state is the parser state (updated when done, so parsing can continue later from where this left off); seenLangs gets all languages the lines use.
+    langs,someLangsUnknown,maxsplit,count,doLimit,limitNo,doPoetry,disablePoem,lastPromptAndWord = state
     allLangs = list2set([firstLanguage,secondLanguage]+otherLanguages)
-    for l in u8strip(read(fname)).replace(B("\r"),B("\n")).split(B("\n")):
+    for l in data.replace(B("\r"),B("\n")).split(B("\n")):
         # TODO can we make this any faster on WinCE with large vocab lists? (tried SOME optimising already)
         if not B("=") in l: # might be a special instruction
             if not l: continue
@@ -273,6 +478,7 @@ def parseSynthVocab(fname,forGUI=0):
                 maxsplit = len(langs)-1
                 for l in langs:
                     if not checkIn(l,allLangs): someLangsUnknown = 1
+                    else: seenLangs[l]=1
             elif l2.startswith(B("limit on")):
                 doLimit = 1 ; limitNo += 1
             elif l2.startswith(B("limit off")): doLimit = 0
@@ -332,12 +538,12 @@ def parseSynthVocab(fname,forGUI=0):
                         prompt=f
                         singleLinePoems[f]=1
                     ret.append((0,S(prompt),S(f)))
-                    if emptyCheck_hack: return ret
+                    if emptyCheck_hack: return
                     if doLimit: limitedFiles[f]=B("synth:"+str(limitNo))
                     if doPoetry: lastPromptAndWord = [prompt_L1only,f]
                 elif doPoetry: disablePoem=1 # if one of the lines can't be synth'd, disable the rest of the poem (otherwise get wrongly connected lines, disconnected lines, or re-introduction of isolated lines that were previously part of a poem but can't be synth'd on this platform)
         if not lastPromptAndWord==None: doPoetry = 1 # just processed a "poetry vocab line" (lastPromptAndWord is either the real last prompt and word, or 0 if we were at the start)
-    return ret
+    state[:] = [langs,someLangsUnknown,maxsplit,count,doLimit,limitNo,doPoetry,disablePoem,lastPromptAndWord]
 
 def sanitise_otherLanguages():
     for l in otherFirstLanguages:
@@ -415,16 +621,33 @@ class AvailablePrompts(object):
         return r
 # Do NOT construct availablePrompts here - if a warning is printed (e.g. can't find a synth) then it might go to the wrong place if GUI has not yet started.  Constructing moved to lesson_loop().
 
+class StartedFiles(object):
+    # Sorted B() names of the files in progressData that
+    # have been done at least once, so introductions() can
+    # bisect instead of scanning the whole of progressData
+    def __init__(self,progressData):
+        self.files = [B(p[-1]) for p in progressData if p[0]]
+        self.files.sort()
+    def add(self,f): insort(self.files,B(f)) # call when an entry's count goes up from 0
+    def anyStartsWith(self,prefix):
+        i = bisect_left(self.files,prefix)
+        return i<len(self.files) and self.files[i].startswith(prefix)
+
+introDirs = (None,0,{}) # (dirsWithIntros it was made from, its length, B(dir) -> entry)
 def introductions(zhFile,progressData):
-    toIntroduce = []
-    for d,fname in dirsWithIntros[:]:
-        found = 0
-        for p in progressData:
-            if B(p[-1]).startswith(B(d)) and p[0]:
-                # this dir has already been introduced
-                found=1 ; dirsWithIntros.remove((d,fname)) ; break
-        if found: continue
-        if B(zhFile).startswith(B(d)): toIntroduce.append((d,fname))
+    # progressData can be a StartedFiles (faster if calling many times)
+    global introDirs
+    if not hasattr(progressData,"anyStartsWith"): progressData = StartedFiles(progressData)
+    if not (introDirs[0] is dirsWithIntros and introDirs[1]==len(dirsWithIntros)): introDirs = (dirsWithIntros,len(dirsWithIntros),dict([(B(d),(d,fname)) for d,fname in dirsWithIntros]))
+    zhFile = B(zhFile) ; toIntroduce = []
+    for i in xrange(len(zhFile)+1): # dirs with intros that zhFile is in are prefixes of it, so just look those up
+        d = zhFile[:i]
+        if not checkIn(d,introDirs[2]): continue
+        if progressData.anyStartsWith(d):
+            # this dir has already been introduced
+            dirsWithIntros.remove(introDirs[2][d]) ; del introDirs[2][d]
+            introDirs = (dirsWithIntros,len(dirsWithIntros),introDirs[2])
+        else: toIntroduce.append(introDirs[2][d])
     toIntroduce.sort() # should put shorter ones 1st
     return map(lambda x: fileToEvent(cond(x[0],x[0]+os.sep,"")+x[1]), toIntroduce)
 
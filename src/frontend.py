@@ -1138,22 +1138,28 @@ def hanzi_only(unitext): return u"".join(filter(lambda x:0x3000<ord(x)<0xa700 or
 def hanzi_and_punc(unitext): return u"".join(filter(lambda x:0x3000<ord(x)<0xa700 or ord(x)>=0x10000 or x in '.,?;:\'()[]!0123456789-', list(remove_tone_numbers(fix_compatibility(unitext))))) # no " as it could be from SGML markup
 # (exclusion of 3000 in above is deliberate, otherwise get problems with hanzi spaces being taken out by fix-compat+strip hence a non-functional 'delete non-hanzi' button appears)
 def guiVocabList(parsedVocab):
+    g = GuiVocabList() ; append = g.append
+    for i in parsedVocab: append(i)
+    return g.ret
+class GuiVocabList(object):
+    # guiVocabList one item at a time, so it can be the sink of parseSynthVocab (then the parsed list needn't be kept).  The result is in .ret
     # This needs to be fast.  Have tried writing interatively rather than filter and map, and assume stuff is NOT already unicode (so just decode rather than call ensure_unicode) + now assuming no !synth: (but can still run with .txt etc)
-    sl2,fl2 = "_"+secondLanguage,"_"+firstLanguage
-    sl3,fl3 = sl2+dottxt, fl2+dottxt # txt files
-    # (sample files are omitted from the list)
-    sl2Len,fl2Len = -len(sl2),-len(fl2)
-    ret = []
-    for a,b,c in parsedVocab:
-        if c.endswith(sl2): c=c[:sl2Len]
-        elif c.endswith(sl3): c=readText(c)
-        else: continue
+    def __init__(self):
+        self.sl2,self.fl2 = "_"+secondLanguage,"_"+firstLanguage
+        self.sl3,self.fl3 = self.sl2+dottxt, self.fl2+dottxt # txt files
+        # (sample files are omitted from the list)
+        self.sl2Len,self.fl2Len = -len(self.sl2),-len(self.fl2)
+        self.ret = []
+    def append(self,item):
+        a,b,c = item
+        if c.endswith(self.sl2): c=c[:self.sl2Len]
+        elif c.endswith(self.sl3): c=readText(c)
+        else: return
         if type(b)==type([]): b=b[cond(len(b)==3,1,-1)]
-        if b.endswith(fl2): b=b[:fl2Len]
-        elif b.endswith(fl3): b=readText(b)
-        else: continue
-        ret.append((ensure_unicode(c),ensure_unicode(b)))
-    return ret
+        if b.endswith(self.fl2): b=b[:self.fl2Len]
+        elif b.endswith(self.fl3): b=readText(b)
+        else: return
+        self.ret.append((ensure_unicode(c),ensure_unicode(b)))
 def readText(l): # see utils/transliterate.py (running guiVocabList on txt files from scanSamples)
     l = B(samplesDirectory)+B(os.sep)+B(l)
     if checkIn(l,variantFiles): # oops. just read the 1st .txt variant
@@ -1320,7 +1326,8 @@ def check_for_slacking():
             except: pass
         else: checkAge(installDateFile,localise("It has been %d days since you installed Gradint and you haven't had a lesson yet.  Please try to have one every day."))
 def checkAge(fname,message):
-    days = int((time.time()-os.stat(fname)[8])/3600/24)
+    if fname==progressFile: days = int((time.time()-progress_mtime())/3600/24)
+    else: days = int((time.time()-os.stat(fname)[8])/3600/24)
     if days>=5 and (days%5)==0: waitOnMessage(message % days)
 
 def s60_addVocab():
@@ -1351,7 +1358,7 @@ def s60_runLesson():
 def s60_viewVocab():
     global justSynthesize
     doLabel("Reading your vocab list, please wait...")
-    vList = map(lambda x:x[0]+u"="+x[1], guiVocabList(parseSynthVocab(vocabFile,1)))
+    vList = map(lambda x:x[0]+u"="+x[1], parseSynthVocab(vocabFile,1,GuiVocabList()).ret)
     if not vList: return waitOnMessage("Your computer-voiced vocab list is empty.")
     while True:
       appuifw.app.body = None
@@ -1505,7 +1512,7 @@ def gui_event_loop():
         while not hasattr(app,"menu_response"):
             if warnings_printed: waitOnMessage("") # If running gui_event_loop, better put any warnings in a separate dialogue now, rather than waiting for user to get one via 'make lesson' or some other method
             if hasattr(app,"needVocablist") and not hasattr(app,"vocabList"):
-                v = guiVocabList(parseSynthVocab(vocabFile,1)) # (in non-GUI thread because can take a while when large)
+                v = parseSynthVocab(vocabFile,1,GuiVocabList()).ret # (in non-GUI thread because can take a while when large)
                 if app: app.vocabList = v # check again because there's a race condition if close the app while parseSynthVocab is running
                 else: return
                 del v
@@ -1923,6 +1930,7 @@ def rest_of_main():
             except: pass
         try: # audio warning in case was away from computer.  Do this last as it may overwrite the exception.
             global soundCollector
+            if soundCollector: soundCollector.abort() # (so a WriterThread and encoder aren't left waiting for the rest of the lesson)
             if app: soundCollector=0
             if not soundCollector and get_synth_if_possible("en",0): synth_event("en","Error in graddint program.").play() # if possible, give some audio indication of the error (double D to try to force correct pronunciation if not eSpeak, e.g. S60)
         except: pass
@@ -1932,6 +1940,7 @@ def rest_of_main():
             elif traceback: traceback.print_exc() # will be wrong if there was an error in speaking
         exitStatus = 1
         if appuifw: raw_input() # so traceback stays visible
+    wait_for_preplan() # (let it finish saving the next lesson before we exit)
     # It is not guaranteed that __del__() methods are called for objects that still exist when the interpreter exits.  So:
     global viable_synths,getsynth_cache,theMp3FileCache
     del viable_synths,getsynth_cache,theMp3FileCache
@@ -15,14 +15,29 @@ class ProgressDatabase(object):
     def __init__(self,alsoScan=1,fromString=0):
         self.data = [] ; self.promptsData = {}
         self.unavail = [] ; self.saved_completely = 0
-        if fromString or not self._load_from_binary():
+        self.db = None ; fromDB = 0
+        if not fromString and sqlite3 and (progress_database or fileExists(progress_database_file())): # (even if not progress_database, in case it's just been switched off)
+            self._open_database()
+            fromDB = self.db and self._load_from_database()
+        if fromDB: pass
+        elif fromString or not self._load_from_binary():
             self._load_from_text(fromString)
             if self.data and not fromString: self.save_binary(self.data) # even before starting, to save time if they press Cancel and then try loading again without futher progressFile changes
+        self.journalLessons = 0 ; self.journalState = None
+        if not fromString:
+            self._load_journal() # (even if not progress_journal, in case it's just been switched off)
+            if self.db and not progress_database:
+                if fromDB: self.dbLessons = progress_journal_compact # switched off: rewrite progressFile (and remove the database) at next save
+                else: self._close_database()
+            elif self.db and not fromDB: self._import_to_database()
+            if progress_journal and not self.db: self.journalState = self._journal_state()
         self.oldPromptsData = self.promptsData.copy() # in case have to save partial (see below)
         if alsoScan:
           global is_first_lesson ; is_first_lesson = (not self.data and not self.unavail) # hack
           self.data += self.unavail # because it might have become available again
-          self.unavail = mergeProgress(self.data,scanSamples()+parseSynthVocab(vocabFile))
+          merger = ProgressMerger(self.data)
+          scanSamples(sink=merger) ; parseSynthVocab(vocabFile,sink=merger)
+          self.unavail = merger.done() ; del merger
           if not cache_maintenance_mode:
             doLabel("Checking transliterations")
             global tList # for Python 2.1
@@ -58,43 +73,36 @@ class ProgressDatabase(object):
         if pickledProgressFile and fileExists(pickledProgressFile):
             if pickle and not (fileExists(progressFile) and os.stat(progressFile)[8] > os.stat(pickledProgressFile)[8]): # we can unpickle the binary version, and text version has not been manually updated since it, so do this
                 global firstLanguage, secondLanguage, otherLanguages
-                if compress_progress_file or (unix and got_program("gzip")):
-                    if paranoid_file_management: open(pickledProgressFile) # ensure ready
-                    f = os.popen('gzip -fdc "'+pickledProgressFile+'"',popenRB)
-                else: f=open(pickledProgressFile,"rb")
-                try: thingsToSet, tup = pickle.Unpickler(f).load()
+                try: thingsToSet, tup = pickle.loads(open_gunzip(pickledProgressFile).read())
                 except: return False # probably moved to a different Python version or something
                 exec(thingsToSet)
                 self._py3_fix()
                 return True
             # otherwise drop out and return None
     def _load_from_text(self,fromString=0):
-        if fromString: expr=fromString
-        elif fileExists(progressFile):
-            if compress_progress_file or (unix and got_program("gzip")):
-                if paranoid_file_management: open(progressFile) # ensure ready
-                expr = readB(os.popen('gzip -fdc "'+progressFile+'"',popenRB))
-            else: expr = read(progressFile)
-        else: expr = None
-        if expr:
+        if fromString: f=None
+        elif fileExists(progressFile): f = open_gunzip(progressFile)
+        else: return self._py3_fix()
+        if re: # read it with ProgressParser (safe, and doesn't need to hold the whole file in memory)
+            parser = ProgressParser(self,cond(fromString,"progress data",progressFile))
+            if f:
+                while True:
+                    line = f.readline()
+                    if not line: break
+                    parser.feed(line)
+            else:
+                for line in B(fromString).split(B("\n")): parser.feed(line)
+            parser.close()
+        else: # no re module: fall back to evaluating it
+          if f: expr = readB(f)
+          else: expr = fromString
+          if expr:
             expr = u8strip(expr).replace(B("\r\n"),B("\n")) # just in case progress.txt has been edited in Notepad
             # First, try evaluating it as self.data (legacy progress.txt from older versions).  If that doesn't work, execute it (newer versions).
             global firstLanguage, secondLanguage, otherLanguages
             try: self.data = eval(expr)
             except TypeError: raise Exception(progressFile+" has not been properly decompressed") # 'expected string without null bytes'
-            except SyntaxError:
-                try: import codeop
-                except: codeop = 0
-                if codeop: # try a lower-memory version (in case text file has been edited by hand and we're on NSLU2 or something) - don't compile all of it at once
-                    lineCache = []
-                    for l in expr.replace(B("\r\n"),B("\n")).split(B("\n")):
-                        lineCache.append(l)
-                        if lineCache[-1].endswith(B(",")): continue # no point trying to compile if it's obviously incomplete
-                        code = codeop.compile_command("# coding=utf-8\n"+S(B("\n").join(lineCache)))
-                        if code:
-                            lineCache = []
-                            exec(code)
-                else: exec(B("# coding=utf-8\n")+expr)
+            except SyntaxError: exec(B("# coding=utf-8\n")+expr)
             del expr
         # Remove legacy extentions in promptsData (needed only when loading from text, as this was before pickledProgressFile was added)
         for k in list(self.promptsData.keys()):
@@ -108,17 +116,21 @@ class ProgressDatabase(object):
         for l in [self.data,self.unavail]:
             for i in range(len(l)):
                 for j in [1,2]:
-                    if type(l[i][j])==str: l[i]=l[i][:j]+(S2(LB(l[i][j])),)+l[i][j+1:]
+                    if type(l[i][j]) in [str,bytes]: l[i]=l[i][:j]+(S2(LB(l[i][j])),)+l[i][j+1:] # (bytes if from save_binary)
                     elif type(l[i][j])==list: l[i]=l[i][:j]+(map(lambda x:S2(LB(x)),l[i][j]),)+l[i][j+1:]
     def save(self,partial=0):
         if need_say_where_put_progress: show_info("Saving "+cond(partial,"partial ","")+"progress to "+progressFile+"... ")
         else: show_info("Saving "+cond(partial,"partial ","")+"progress... ")
+        if (self.db and progress_database and self._save_database()) or (self.journalState and self._save_journal()):
+            if not partial: self.saved_completely = 1
+            if not app and not appuifw and not android: show_info("done\n")
+            return
         global progressFileBackup
         # Remove 0-repeated items (helps editing by hand)
         data = [] # don't use self.data - may want to make another lesson after saving
         for a,b,c in self.data:
             if a: data.append(denumber_filelists(a,b,c))
-        sort(data,cmpfunc) # to normalise when using diff etc
+        sortByKey(data,cmpkey) # to normalise when using diff etc
         if progressFileBackup:
             try:
                 import shutil
@@ -129,15 +141,11 @@ class ProgressDatabase(object):
             progressFileBackup = None
         while True:
           try:
-            if compress_progress_file:
-              if paranoid_file_management: fn=os.tempnam() # on some ftpfs setups gzip can fail causing silent corruption
-              else: fn=progressFile
-              f=os.popen('gzip -9 > "'+fn+'"','w')
-            else: f = open(progressFile,'w')
+            f = SaveFile(progressFile,compress_progress_file)
             global progressFileHeader
             if type(u"")==type(""): # Python 3: ensure UTF-8
                 import codecs
-                realF,f = f,codecs.getwriter("utf-8")(f.buffer)
+                realF,f = f,codecs.getwriter("utf-8")(f)
                 progressFileHeader=progressFileHeader.replace("mode: python ","mode: python; coding: utf-8")
             else: realF = f
             f.write(progressFileHeader)
@@ -147,8 +155,13 @@ class ProgressDatabase(object):
             f.write("self.promptsData=") ; pprint.PrettyPrinter(indent=2,width=60,stream=f).pprint(self.promptsData)
             prettyPrintLongList(f,"self.unavail",self.unavail)
             realF.close()
-            if compress_progress_file and paranoid_file_management: write(progressFile,read(fn)),os.remove(fn)
             self.save_binary(data)
+            if fileExists(progress_journal_file()): os.remove(progress_journal_file()) # it's all in progressFile now
+            if self.db and progress_database: self._import_to_database() # (also records progressFile's new date stamp so we don't import it back)
+            elif sqlite3 and fileExists(progress_database_file()):
+                self._close_database() ; os.remove(progress_database_file())
+            self.journalLessons = 0
+            if progress_journal: self.journalState = self._journal_state()
           except IOError: # This can happen for example on some PocketPC devices if you reconnect the power during progress save (which is likely if you return the device to the charger when lesson finished)
             if app or appuifw or android:
               if getYN("I/O fault when saving progress. Retry?"): continue
@@ -160,31 +173,190 @@ class ProgressDatabase(object):
     def save_binary(self,data): # save a pickled version if possible (no error if not)
         if not (pickledProgressFile and pickle): return
         try:
-            if compress_progress_file:
-              if paranoid_file_management: fn=os.tempnam()
-              else: fn=pickledProgressFile # TODO near-duplicate code with above
-              f=os.popen('gzip -9 > "'+fn+'"',popenWB)
-              if hasattr(f,'buffer'): _,f = f,f.buffer
-            else: f = open(pickledProgressFile,'wb')
+            f = SaveFile(pickledProgressFile,compress_progress_file)
             pickle.Pickler(f,-1).dump(("self.data,self.promptsData,self.unavail,firstLanguage,secondLanguage = tup", (data,self.promptsData,self.unavail,firstLanguage,secondLanguage)))
             f.close()
-            if compress_progress_file and paranoid_file_management: write(pickledProgressFile,read(fn)),os.remove(fn)
-        except IOError: pass # OK if not got permissions to do it (NB need to catch the write as well because popen won't throw, and don't have to worry about a corrupted partial binary because loader would ignore it)
+        except IOError: pass # OK if not got permissions to do it (and don't have to worry about a partial binary because SaveFile won't put it in place)
+    def _journal_state(self):
+        # What save() would write, as (data,unavail,promptsData,languages) where data is a dictionary of journal_key -> ([timesDone,...],promptFile,zhFile)
+        data = {}
+        for a,b,c in self.data:
+            if not a: continue
+            a,b,c = denumber_filelists(a,b,c)
+            k = journal_key(b,c)
+            if checkIn(k,data):
+                data[k][0].append(a) ; data[k][0].sort() # (shouldn't normally get duplicates)
+            else: data[k] = ([a],journal_norm(b),journal_norm(c))
+        return (data,self.unavail[:],self.promptsData.copy(),(firstLanguage,secondLanguage))
+    def _changes(self,state):
+        # Compare the current progress against a _journal_state, and return (new state,records) where records describe what's changed (see _load_journal)
+        data,unavail,promptsData,langs = new = self._journal_state()
+        oldData,oldUnavail,oldPromptsData,oldLangs = state
+        records = []
+        for k,v in list(data.items()):
+            if not checkIn(k,oldData) or not oldData[k][0]==v[0]: records.append(("d",)+v)
+        for k,v in list(oldData.items()):
+            if not checkIn(k,data): records.append(("d",[])+v[1:])
+        if not unavail==oldUnavail: records.append(("u",journal_norm_list(unavail)))
+        for k,v in list(promptsData.items()):
+            if not oldPromptsData.get(k,None)==v: records.append(("p",k,v))
+        for k in list(oldPromptsData.keys()):
+            if not checkIn(k,promptsData): records.append(("P",k))
+        if not langs==oldLangs: records.append(("l",)+langs)
+        return new,records
+    def _save_journal(self):
+        # Append what's changed since the last save to the
+        # progress journal, and return True.  Returns False
+        # if it's time to do a full save instead.
+        if self.journalLessons >= progress_journal_compact or not crc32 or not re or not fileExists(progressFile): return False
+        new,records = self._changes(self.journalState)
+        records.append(("end",len(records)))
+        f = open(progress_journal_file(),"ab")
+        f.write(B("").join([journal_record(r) for r in records]))
+        f.flush()
+        if hasattr(os,"fsync"): os.fsync(f.fileno())
+        f.close()
+        self.journalState = new ; self.journalLessons += 1
+        return True
+    def _load_journal(self):
+        # Replay any progress journal on top of what we've loaded from progressFile
+        if not fileExists(progress_journal_file()): return
+        if not re: # (we can't have written it, as _save_journal needs re)
+            show_warning("Can't read "+progress_journal_file()+" without the re module")
+            self.journalLessons = progress_journal_compact ; return
+        data = {} # journal_key -> [(timesDone,b,c),...]
+        for a,b,c in self.data:
+            k = journal_key(b,c)
+            if checkIn(k,data): data[k].append((a,b,c))
+            else: data[k] = [(a,b,c)]
+        batch = [] ; complete = 1
+        for line in read(progress_journal_file()).split(B("\n")):
+            if not line: continue
+            r = None
+            try:
+                checksum,record = line.split(B(" "),1)
+                if not crc32 or int(checksum,16)==crc32(record)&0xffffffff: r = progress_literal(record)
+            except ValueError: pass # (malformed line; will stop below)
+            if not type(r)==tuple or not r:
+                complete = 0 ; break
+            if not r[0]=="end":
+                batch.append(r) ; continue
+            if not r[1]==len(batch):
+                complete = 0 ; break
+            for r in batch: # whole lesson's worth is here, so apply it
+                if r[0]=="d":
+                    b,c = journal_unnorm(r[2]),journal_unnorm(r[3]) # in case the journal was written by Python 2
+                    data[journal_key(b,c)] = [(a,b,c) for a in r[1]]
+                elif r[0]=="u": self.unavail = r[1]
+                elif r[0]=="p": self.promptsData[r[1]] = r[2]
+                elif r[0]=="P": del self.promptsData[r[1]]
+            batch = [] ; self.journalLessons += 1
+        if batch or not complete:
+            show_warning("Ignoring incomplete end of "+progress_journal_file()+" (probably interrupted while saving)")
+            self.journalLessons = progress_journal_compact # so next save rewrites everything and starts a new journal
+        self.data = []
+        for l in data.values(): self.data += l
+        sortByKey(self.data,cmpkey)
+        if type(u"")==type(""): self.unavail = journal_norm_list(self.unavail)
+    def _open_database(self):
+        try:
+            self.db = sqlite3.connect(progress_database_file())
+            self.db.executescript("""create table if not exists progress(k text not null,timesDone integer not null);
+create index if not exists progress_k on progress(k);
+create index if not exists progress_timesDone on progress(timesDone);
+create table if not exists unavail(k text not null,timesDone integer not null);
+create table if not exists prompts(k text primary key,v text);
+create table if not exists meta(k text primary key,v text);""")
+        except sqlite3.Error:
+            show_warning("Could not open "+progress_database_file()+": "+str(sys.exc_info()[1]))
+            self.db = None
+        self.dbLessons = 0
+    def _close_database(self):
+        if self.db: self.db.close()
+        self.db = None
+    def _progressFile_stamp(self):
+        # so we can tell if progressFile has been changed since we last wrote or imported it (e.g. edited by hand)
+        if not fileExists(progressFile): return "None"
+        s = os.stat(progressFile)
+        return repr((s.st_size,int(s.st_mtime)))
+    def _load_from_database(self):
+        # Load progress from the database, if it's up to date with progressFile
+        try:
+            meta = {}
+            for k,v in self.db.execute("select k,v from meta"): meta[k]=db_eval(v)
+            if not meta.get("progressFile",None)==self._progressFile_stamp(): return False
+            data = []
+            for k,a in self.db.execute("select k,timesDone from progress"):
+                b,c = db_eval(k) ; data.append((a,journal_unnorm(b),journal_unnorm(c)))
+            unavail = []
+            for k,a in self.db.execute("select k,timesDone from unavail order by rowid"):
+                b,c = db_eval(k) ; unavail.append((a,journal_unnorm(b),journal_unnorm(c)))
+            promptsData = {}
+            for k,v in self.db.execute("select k,v from prompts"): promptsData[db_eval(k)]=db_eval(v)
+        except sqlite3.Error: return False
+        except ValueError: # not a literal: don't trust it
+            show_warning("Ignoring "+progress_database_file()+": "+str(sys.exc_info()[1]))
+            return False
+        sortByKey(data,cmpkey) # as save() does
+        self.data,self.unavail,self.promptsData = data,unavail,promptsData
+        self.dbState = self._journal_state() ; self.dbLessons = meta.get("lessons",0)
+        return True
+    def _import_to_database(self):
+        # Replace the database's contents with what save() would write to progressFile
+        state = self._journal_state()
+        data,unavail,promptsData,langs = state
+        try:
+            for t in ["progress","unavail","prompts","meta"]: self.db.execute("delete from "+t)
+            rows = []
+            for k,v in data.items():
+                for a in v[0]: rows.append((k,a))
+            self.db.executemany("insert into progress values (?,?)",rows)
+            self.db.executemany("insert into unavail values (?,?)",[(journal_key(e[1],e[2]),e[0]) for e in unavail])
+            self.db.executemany("insert into prompts values (?,?)",[(repr(k),repr(v)) for k,v in promptsData.items()])
+            self.db.executemany("insert into meta values (?,?)",[("firstLanguage",repr(langs[0])),("secondLanguage",repr(langs[1])),("progressFile",repr(self._progressFile_stamp()))])
+            self.db.commit()
+        except sqlite3.Error:
+            show_warning("Could not write "+progress_database_file()+": "+str(sys.exc_info()[1]))
+            self._close_database() ; return
+        self.dbState = state ; self.dbLessons = 0
+    def _save_database(self):
+        # Update just the rows that have changed since the
+        # last save, and return True.  Returns False if it's
+        # time to rewrite progressFile instead.
+        if self.dbLessons >= progress_journal_compact or not fileExists(progressFile): return False
+        new,records = self._changes(self.dbState)
+        try:
+            for r in records:
+                if r[0]=="d":
+                    k = journal_key(r[2],r[3])
+                    self.db.execute("delete from progress where k=?",(k,))
+                    self.db.executemany("insert into progress values (?,?)",[(k,a) for a in r[1]])
+                elif r[0]=="u":
+                    self.db.execute("delete from unavail")
+                    self.db.executemany("insert into unavail values (?,?)",[(journal_key(e[1],e[2]),e[0]) for e in r[1]])
+                elif r[0]=="p": self.db.execute("insert or replace into prompts values (?,?)",(repr(r[1]),repr(r[2])))
+                elif r[0]=="P": self.db.execute("delete from prompts where k=?",(repr(r[1]),))
+                elif r[0]=="l": self.db.executemany("insert or replace into meta values (?,?)",[("firstLanguage",repr(r[1])),("secondLanguage",repr(r[2]))])
+            self.db.execute("insert or replace into meta values ('lessons',?)",(repr(self.dbLessons+1),))
+            self.db.commit()
+        except sqlite3.Error:
+            self.db.rollback()
+            show_warning("Could not update "+progress_database_file()+": "+str(sys.exc_info()[1]))
+            return False # and save() will write progressFile and re-import it
+        self.dbState = new ; self.dbLessons += 1
+        return True
     def savePartial(self,filesNotPlayed):
         curPD,curDat = self.promptsData, self.data[:] # in case want to save a more complete one later
         self.promptsData = self.oldPromptsData # partial recovery of prompts not implemented
         if hasattr(self,"previous_filesNotPlayed"):
-            i=0
-            while i<len(filesNotPlayed):
-                if checkIn(filesNotPlayed[i],self.previous_filesNotPlayed): i+=1
-                else: del filesNotPlayed[i] # cumulative effects if managed to play it last time but not this time (and both lessons incomplete)
+            filesNotPlayed[:] = filter(lambda f,p=self.previous_filesNotPlayed:checkIn(f,p),filesNotPlayed) # cumulative effects if managed to play it last time but not this time (and both lessons incomplete)
         self.previous_filesNotPlayed = filesNotPlayed = list2set(filesNotPlayed)
         if not filesNotPlayed:
             # actually done everything on overlaps
             self.promptsData=curPD
             return self.save()
         changed = 0
-        for i in xrange(len(self.data)):
+        for i in list(self.oldData.keys()): # (the other items haven't changed anyway)
             if type(self.data[i][1])==type([]): l=self.data[i][1][:]
             else: l=[self.data[i][1]]
             l.append(self.data[i][2])
@@ -198,11 +370,18 @@ class ProgressDatabase(object):
         elif app==None and not appuifw and not android: show_info("No sequences were fully complete so no changes saved\n")
         self.promptsData,self.data = curPD,curDat
     def makeLesson(self):
-        global maxLenOfLesson
+        global maxLenOfLesson,planningDbase
+        planningDbase = self # for randomInstruction (this isn't the global dbase if preplan is making the next lesson)
         self.l = Lesson()
-        sort(self.data,cmpfunc) ; jitter(self.data)
-        self.oldData = self.data[:] # for handling interrupts & partial progress saves
+        sortByKey(self.data,cmpkey) ; jitter(self.data)
+        self.oldData = {} # index -> item before this lesson changed it, for handling interrupts & partial progress saves (the other items are unchanged, so no need to copy the whole of self.data)
         self.exclude = {} ; self.do_as_poem = {}
+        self.byTimesDone = {} # timesDone -> indices into self.data (in order), so addToLesson needn't scan the whole of self.data for each range
+        for i in xrange(len(self.data)):
+            t = self.data[i][0]
+            if checkIn(t,self.byTimesDone): self.byTimesDone[t].append(i)
+            else: self.byTimesDone[t] = indexArray([i])
+        self.started = StartedFiles(self.data) # for introductions()
         # First priority: Recently-learned old words
         # (But not too many - want room for new words)
         num=self.addToLesson(1,knownThreshold,1,recentInitialNumToTry,maxReviseBeforeNewWords)
@@ -228,7 +407,7 @@ class ProgressDatabase(object):
             rdl,rdl2,randomDropLevel,randomDropLevel2 = randomDropLevel,randomDropLevel2,0,0
             self.addToLesson(reallyKnownThreshold,-1,1,1,-1)
             randomDropLevel, randomDropLevel2 = rdl,rdl2
-        l = self.l ; del self.l, self.responseIndex, self.do_as_poem
+        l = self.l ; del self.l, self.responseIndex, self.do_as_poem, self.byTimesDone, self.started
         if not l.events: raise Exception("Didn't manage to put anything in the lesson")
         if commentsToAdd: l.addSequence(commentSequence(),False)
         if orderlessCommentsToAdd:
@@ -267,6 +446,7 @@ class ProgressDatabase(object):
             l.events.append((t,SampleEvent(promptsDirectory+os.sep+"end"+dotwav)))
             show_warning("Warning: Using legacy end"+dotwav+" - please change it to end_"+firstLanguage+dotwav+" and end_"+secondLanguage+dotwav+" (or "+extsep+"txt if you have synthesis)")
         l.cap_max_lateness()
+        save_soundInfoCache()
         return l
     def addToLesson(self,minTimesDone=0,maxTimesDone=-1,minNumToTry=0,maxNumToTry=0,maxNumToAdd=-1):
         # Service routine - adds some words to the lesson
@@ -278,13 +458,17 @@ class ProgressDatabase(object):
         if maxNumToAdd==None: return 0
         numberAdded = 0
         newWordTimes = {}
+        candidates = [] # indices of self.data that are in range this time
+        for timesDone,indices in list(self.byTimesDone.items()):
+            if timesDone >= minTimesDone and (maxTimesDone<0 or timesDone <= maxTimesDone): candidates += list(indices)
+        candidates.sort() # same order as going through self.data (entries that change are also excluded, so their timesDone here is still correct)
         for numToTry in range(maxNumToTry,minNumToTry-1,-1):
             numFailures = 0 ; startTime = time.time() # for not taking too long
-            for i in xrange(len(self.data)):
+            candidates = [i for i in candidates if not checkIn(i,self.exclude)] # (drop any we've already had)
+            for i in candidates:
                 if maxNumToAdd>-1 and numberAdded >= maxNumToAdd: break # too many
                 if checkIn(i,self.exclude): continue # already had it
                 (timesDone,promptFile,zhFile)=self.data[i]
-                if timesDone < minTimesDone or (maxTimesDone>=0 and timesDone > maxTimesDone): continue # out of range this time
                 if timesDone >= knownThreshold: thisNumToTry = min(random.choice([2,3,4]),numToTry)
                 else: thisNumToTry = numToTry
                 if timesDone >= randomDropThreshold and random.random() <= calcDropLevel(timesDone):
@@ -295,7 +479,7 @@ class ProgressDatabase(object):
                     # this is part of a "known poem" and let's try to do it in sequence
                     self.try_add_poem(self.do_as_poem[i]) ; continue
                 oldPromptsData = self.promptsData.copy()
-                seq=anticipationSequence(promptFile,zhFile,timesDone,timesDone+thisNumToTry,self.promptsData,introductions(zhFile,self.data))
+                seq=anticipationSequence(promptFile,zhFile,timesDone,timesDone+thisNumToTry,self.promptsData,introductions(zhFile,self.started))
                 seq[0].timesDone = timesDone # for diagram.py (and now status messages) to know if it's a new word
                 global earliestAllowedEvent ; earliestAllowedEvent = 0
                 if not timesDone and type(promptFile)==type([]):
@@ -323,7 +507,9 @@ class ProgressDatabase(object):
                 # Keep a count
                 if not timesDone: self.l.newWords += 1
                 else: self.l.oldWords += 1
+                if not checkIn(i,self.oldData): self.oldData[i]=self.data[i]
                 self.data[i]=(timesDone+thisNumToTry,promptFile,zhFile)
+                if not timesDone: self.started.add(zhFile)
                 if not timesDone: newWordTimes[zhFile] = seq[0].getEventStart(0) # track where it started
         return numberAdded
     def try_add_poem(self,poem):
@@ -342,7 +528,11 @@ class ProgressDatabase(object):
         try: self.l.addSequence(poemSequence)
         except StretchedTooFar: return
         self.l.oldWords += 1 # have to only count it as one due to endseq handling
-        for line in poem: self.data[self.responseIndex[line]]=(self.data[self.responseIndex[line]][0]+1,)+self.data[self.responseIndex[line]][1:]
+        for line in poem:
+            i = self.responseIndex[line]
+            if not self.data[i][0]: self.started.add(line)
+            if not checkIn(i,self.oldData): self.oldData[i]=self.data[i]
+            self.data[i]=(self.data[i][0]+1,)+self.data[i][1:]
     def veryExperienced(self):
         # used for greater abbreviation in the prompts etc
         x = getattr(self,'cached_very_experienced',None)
@@ -369,6 +559,34 @@ class ProgressDatabase(object):
             if not covered==actualCovered: toRet += (" (actually %d new %d old)" % (actualTotal-actualCovered,actualCovered))
         return toRet
 
+try: from binascii import crc32
+except: crc32 = None
+def journal_norm(x):
+    # as prettyPrintLongList: on Python 3, output strings rather than bytes
+    if not type("")==type(u""): return x
+    if type(x)==bytes: return S2(x)
+    elif type(x)==list: return map(S2,x)
+    return x
+def journal_unnorm(x):
+    # as _py3_fix, for values that might have been written by Python 2
+    if not type("")==type(u""): return x
+    if type(x)==str: return S2(LB(x))
+    elif type(x)==list: return map(lambda y:S2(LB(y)),x)
+    return x
+def journal_norm_list(l): return [(e[0],journal_norm(e[1]),journal_norm(e[2]))+e[3:] for e in l]
+def journal_key(b,c): return repr((journal_norm(b),journal_norm(c)))
+try: import sqlite3
+except: sqlite3 = None
+if not re: sqlite3 = None # (db_eval needs progress_literal)
+def db_eval(v):
+    # Keys and values in the database are repr()s, read back with progress_literal (not eval) so a tampered-with database can't run code
+    if not type(v)==type(""): v=v.encode('utf-8') # Python 2 gets unicode back from sqlite3
+    return progress_literal(v)
+def journal_record(r):
+    # one line of the progress journal: CRC-32 of the record, then the record
+    r = B(repr(r))
+    return B("%08x " % (crc32(r)&0xffffffff))+r+B("\n")
+
 def prettyPrintLongList(f,thing,data):
     # help the low-memory compile by splitting it up (also helps saving on slow machines, see below)
     step = 50 # number of items to do in one go
@@ -394,6 +612,146 @@ def prettyPrintLongList(f,thing,data):
             for d in dat: f.write("  "+repr(d)+",\n")
             f.write("]\n")
 
+class ProgressParser(object):
+    # Reads what save() writes to progressFile (and legacy
+    # progress files that are just the list), a line at a
+    # time, without eval or exec, so an untrusted progress
+    # file can't run code.  Only literals (strings, numbers,
+    # lists, tuples, dicts, True/False/None) are accepted,
+    # and only the variables save() sets can be assigned to.
+    def __init__(self,db,fname):
+        self.db,self.fname = db,fname
+        self.toks = [] ; self.depth = 0 ; self.lineNo = 0
+        self.first = 1
+    def feed(self,line):
+        self.lineNo += 1
+        if self.lineNo==1: line = u8strip(line)
+        line = S(line)
+        for tok in progress_token.findall(line):
+            if tok[0]: # the usual (timesDone, 'promptFile', 'zhFile') in one go
+                self.toks.append((5,(int(tok[0]),tok[1],tok[2]))) ; continue
+            for kind in xrange(5):
+                if tok[kind+3]: break
+            else: continue # comment or blank
+            if kind==4: self.error("unexpected "+repr(tok[7]))
+            t = tok[kind+3]
+            if kind==3:
+                if t in "[({": self.depth += 1
+                elif t in "])}": self.depth -= 1
+                elif t==";" and not self.depth:
+                    self.statement() ; continue
+            self.toks.append((kind,t))
+        if not self.depth: self.statement()
+    def close(self):
+        if self.toks: self.error("unexpected end of file")
+    def error(self,msg): raise Exception("%s line %d: %s" % (self.fname,self.lineNo,msg))
+    def statement(self):
+        toks,self.toks = self.toks,[]
+        if not toks: return
+        if len(toks)>1 and toks[0][0]==2 and (toks[1]==(3,"=") or toks[1]==(3,"+=")): name,op,i = toks[0][1],toks[1][1],2
+        elif self.first: name,op,i = "self.data","=",0 # legacy: the whole file is self.data
+        else: self.error("expected an assignment")
+        self.first = 0
+        try: value,i = progress_value(toks,i)
+        except IndexError: self.error("incomplete value")
+        except ValueError: self.error(str(sys.exc_info()[1]))
+        if i<len(toks): self.error("unexpected "+repr(toks[i][1]))
+        if name in ["self.data","self.unavail"] and type(value)==type([]):
+            if op=="=": setattr(self.db,name[5:],value)
+            else: getattr(self.db,name[5:]).extend(value)
+        elif name=="self.promptsData" and op=="=" and type(value)==type({}): self.db.promptsData = value
+        elif name in ["firstLanguage","secondLanguage","otherLanguages"] and op=="=": pass # (for information only: settings.txt's languages take precedence, as they always have when progressFile was exec'd)
+        else: self.error("can't set "+name)
+
+if re: progress_token = re.compile(r"""\s*(?:#.*|\(\s*([0-9]+),\s*'([^'\\\n]*)',\s*'([^'\\\n]*)'\s*\)|([uUbB]?[rR]?(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"))|(-?[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?[lL]?)|([A-Za-z_][A-Za-z_0-9.]*)|(\+=|[][(){},:=;])|(\S))""")
+def progress_value(toks,i):
+    # parse a literal starting at toks[i], return (value,next i)
+    kind,t = toks[i]
+    if kind==5: return t,i+1 # already parsed by the tokenizer
+    elif kind==0: # string, maybe followed by more strings (pprint splits long ones)
+        v = progress_string(t) ; i += 1
+        while i<len(toks) and toks[i][0]==0:
+            v += progress_string(toks[i][1]) ; i += 1
+        return v,i
+    elif kind==1:
+        if "." in t or "e" in t or "E" in t: return float(t),i+1
+        return int(t.rstrip("lL")),i+1
+    elif kind==2:
+        if t=="True": return True,i+1
+        elif t=="False": return False,i+1
+        elif t=="None": return None,i+1
+        raise ValueError("unexpected "+t)
+    elif t in "[(":
+        close = cond(t=="[","]",")") ; l = [] ; i += 1 ; comma = 0
+        while not toks[i]==(3,close):
+            v,i = progress_value(toks,i) ; l.append(v)
+            if toks[i]==(3,","): i += 1 ; comma = 1
+            elif not toks[i]==(3,close): raise ValueError("unexpected "+repr(toks[i][1]))
+        if t=="[": return l,i+1
+        elif len(l)==1 and not comma: return l[0],i+1 # just brackets
+        return tuple(l),i+1
+    elif t=="{":
+        d = {} ; i += 1
+        while not toks[i]==(3,"}"):
+            k,i = progress_value(toks,i)
+            if not toks[i]==(3,":"): raise ValueError("expected :")
+            d[k],i = progress_value(toks,i+1)
+            if toks[i]==(3,","): i += 1
+            elif not toks[i]==(3,"}"): raise ValueError("unexpected "+repr(toks[i][1]))
+        return d,i+1
+    raise ValueError("unexpected "+repr(t))
+def progress_literal(s):
+    # Parses one repr()'d value (as in the progress journal and database) with ProgressParser's tokenizer and progress_value, so it can't run code.  Raises ValueError if it's not a literal.
+    toks = []
+    for tok in progress_token.findall(S(s)):
+        if tok[0]: toks.append((5,(int(tok[0]),tok[1],tok[2]))) ; continue
+        for kind in xrange(5):
+            if tok[kind+3]: break
+        else: continue
+        if kind==4: raise ValueError("unexpected "+repr(tok[7]))
+        toks.append((kind,tok[kind+3]))
+    if not toks: raise ValueError("no value")
+    try: value,i = progress_value(toks,0)
+    except IndexError: raise ValueError("incomplete value")
+    if i<len(toks): raise ValueError("unexpected "+repr(toks[i][1]))
+    return value
+def progress_string(t):
+    # Decodes a string literal as the Python that wrote it would have (bytes on Python 2 unless u'', text on Python 3 unless b''), without eval
+    q = 0
+    while not t[q] in "'\"": q += 1
+    prefix,body = t[:q].lower(),t[q+1:-1]
+    py3 = (type("")==type(u""))
+    isText = ("u" in prefix or (py3 and not "b" in prefix))
+    if isText and not py3: body = body.decode('utf-8')
+    if "\\" in body:
+        if not "r" in prefix: body = progress_escape.sub(lambda m,isText=isText:progress_unescape(m.group(1),isText),body)
+        elif "u" in prefix: body = progress_uescape.sub(lambda m:progress_unescape(m.group(1),1),body) # Python 2's ur'' still does \u
+    if py3 and not isText:
+        try: return body.encode('latin1')
+        except UnicodeError: raise ValueError("non-ASCII character in bytes literal")
+    return body
+progress_escapes = {"\n":"","\\":"\\","'":"'",'"':'"',"a":"\a","b":"\b","f":"\f","n":"\n","r":"\r","t":"\t","v":"\v"}
+if re:
+    progress_escape = re.compile(r"\\(x[0-9a-fA-F]{2}|[0-7]{1,3}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N\{[^}]*\}|.)",re.DOTALL)
+    progress_uescape = re.compile(r"\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8})")
+try: import unicodedata
+except: unicodedata = None
+def progress_unescape(e,isText):
+    # e is what follows a backslash in a string literal (see progress_escape)
+    if checkIn(e,progress_escapes): return progress_escapes[e]
+    if e[0] in "xuUN01234567":
+        if e[0]=="x" or e[0] in "01234567" or isText:
+            if e[0]=="N":
+                if len(e)<3 or not unicodedata: raise ValueError("can't decode \\"+e)
+                try: return unicodedata.lookup(e[2:-1])
+                except KeyError: raise ValueError("unknown character name \\"+e)
+            if len(e)==1 and not e[0] in "01234567": raise ValueError("truncated \\"+e+" escape")
+            if e[0] in "01234567": n = int(e,8)
+            else: n = int(e[1:],16)
+            if isText or type("")==type(u""): return unichr(n)
+            return chr(n)
+    return "\\"+e # (not an escape, so the backslash stays)
+
 def calcDropLevel(timesDone):
     # assume timesDone > randomDropThreshold
     if timesDone > randomDropThreshold2:
@@ -421,6 +779,20 @@ def cmpfunc(x,y):
     x2 = (my_toString(x[1]).replace(B(os.sep),chr(0)), my_toString(x[2]).replace(B(os.sep),chr(0)))
     y2 = (my_toString(y[1]).replace(B(os.sep),chr(0)), my_toString(y[2]).replace(B(os.sep),chr(0)))
     return cmpfunc_test(x2,y2)
+def cmpkey(x):
+    # Sort key giving the same order as cmpfunc, but worked out once per item instead of at every comparison
+    if x[0]: return (x[0],cmpkey_item(x[1]),cmpkey_item(x[2]))
+    return (0,cmpkey_toString(x[1]).replace(bSep,bNul),cmpkey_toString(x[2]).replace(bSep,bNul))
+def cmpkey_toString(x):
+    if type(x)==type([]): return B("").join(map(B,x))
+    else: return B(x)
+if type("")==type(u""): # Python 3: strings, lists and bytes can't be compared with each other, so cmpfunc_test compares their repr()s, which puts them in this order
+    def cmpkey_item(x):
+        if type(x)==type([]): return (1,map(cmpkey_item,x))
+        elif type(x)==bytes: return (2,x)
+        else: return (0,x)
+else:
+    def cmpkey_item(x): return x
 def cmpfunc_test(x,y):
     try:
         if x < y: return -1
@@ -440,43 +812,57 @@ def denumber_filelists(r,x,y):
     if type(y)==type([]): y=map(lambda z:denumber_synth(z),y)
     else: y=denumber_synth(y)
     return (r,x,y)
+bSynth,bDotwav,bDotmp3,bExtsep,bBackslash,bSlash,bDot,bSep,bNul = B("!synth:"),B(dotwav),B(dotmp3),B(extsep),B("\\"),B("/"),B("."),B(os.sep),chr(0) # (so denumber_synth etc needn't keep converting them)
 def denumber_synth(z,also_norm_extsep=0):
-    z=B(z) ; zf = z.find(B("!synth:"))
+    z=B(z) ; zf = z.find(bSynth)
     if zf>=0:
         z=lower(z[zf:]) # so ignores the priority-number it had (because the vocab.txt file might have been re-organised hence changing all the numbers).  Also a .lower() so case changes don't change progress.  (Old versions of gradint said .lower() when parsing vocab.txt, but this can cause problems with things like Mc[A-Z].. in English espeak)
-        if z.endswith(B(dotwav)) or z.endswith(B(dotmp3)): return z[:z.rindex(B(extsep))] # remove legacy extensions from synth vocab
-    elif also_norm_extsep: return z.replace(B("\\"),B("/")).replace(B("."),B("/")) # so compares equally across platforms with os.sep and extsep differences
+        if z.endswith(bDotwav) or z.endswith(bDotmp3): return z[:z.rindex(bExtsep)] # remove legacy extensions from synth vocab
+    elif also_norm_extsep: return z.replace(bBackslash,bSlash).replace(bDot,bSlash) # so compares equally across platforms with os.sep and extsep differences
     return z
 
+def norm_file(z):
+    z = B(z) ; i = z.rfind(bExtsep)
+    if i>=0: z = z[:i] # so user can change e.g. wav to mp3 without disrupting progress.txt
+    return denumber_synth(z,1)
 def norm_filelist(x,y):
-    def noext(x): return (B(x)+B(' '))[:B(x).rfind(B(extsep))] # so user can change e.g. wav to mp3 without disrupting progress.txt (the ' ' is simply removed if rfind returns -1)
-    if type(x)==type([]): x=tuple(map(lambda z,noext=noext:denumber_synth(noext(z),1),x))
-    else: x=denumber_synth(noext(x),1)
-    if type(y)==type([]): y=tuple(map(lambda z,noext=noext:denumber_synth(noext(z),1),y))
-    else: y=denumber_synth(noext(y),1)
+    if type(x)==type([]): x=tuple(map(norm_file,x))
+    else: x=norm_file(x)
+    if type(y)==type([]): y=tuple(map(norm_file,y))
+    else: y=norm_file(y)
     return (x,y)
 def mergeProgress(progList,scan):
     # Merges a progress database with a samples scan, to
     # pick up any new samples that were added since last
     # time.  Appends to progList.  Return value see below.
-    proglistDict = {} ; scanlistDict = {} ; n = 0
-    while n<len(progList):
-        i,j,k = progList[n]
-        if i:
-            proglistDict[norm_filelist(j,k)]=n
-            # (DO need to call denumber_synth (called by
-            # norm_filelist) on existing data, because might
-            # be loading a legacy progress.txt which has
-            # numbers before !synth) (as well as the .lower() thing)
-            n += 1
-        else: del progList[n]
+    merger = ProgressMerger(progList)
+    for item in scan: merger.append(item)
+    return merger.done()
+
+class ProgressMerger(object):
+    # mergeProgress one item at a time: pass this as the
+    # sink of scanSamples and parseSynthVocab so they
+    # needn't build lists of everything they find
+    def __init__(self,progList):
+        progList[:] = filter(lambda x:x[0],progList)
         # (take out any 0s - add them back in only if still
         # in the scan.  This makes re-organisation etc
         # easier.  NB this duplicates the functionality in
         # save(), but useful if upgrading from an old
         # version.)
-    renames = {}
-    for (_,j,k) in scan:
+        self.progList = progList
+        self.keys = keys = map(lambda x:norm_filelist(x[1],x[2]),progList) # the normalised key of each progList item, kept in step with it so it's worked out only once
+        # (DO need to call denumber_synth (called by
+        # norm_filelist) on existing data, because might
+        # be loading a legacy progress.txt which has
+        # numbers before !synth) (as well as the .lower() thing)
+        proglistDict = {}
+        for n in xrange(len(keys)): proglistDict[keys[n]]=n
+        self.proglistDict,self.scanlistDict,self.renames = proglistDict,{},{}
+    def append(self,item):
+        i,j,k = item
+        if i: item = (0,j,k) # (else can keep the scan's tuple)
+        progList,proglistDict,renames = self.progList,self.proglistDict,self.renames
         key = norm_filelist(j,k)
         if checkIn(key,proglistDict):
             # an existing item - but in the case of synth'd vocab, we need to take the capitals/lower-case status from the scan rather than from the progress file (see comment above in denumber_synth) so:
@@ -493,28 +879,34 @@ def mergeProgress(progList,scan):
                 key2 = (key[0][:ki+1]+key[0][key[0].rindex("_"):],key[1][:ki+1]+key[1][key[1].rindex("_"):])
                 if checkIn(key2,proglistDict):
                     if not checkIn(key2,renames): renames[key2] = []
-                    renames[key2].append((j,k))
+                    renames[key2].append((j,k,key))
                     found=1 ; break
                 while ki>lastDirsep and "0"<=normK[ki]<="9": ki -= 1
-            if not found: progList.append((0,j,k)) # new item
-        else: progList.append((0,j,k)) # ditto
-        scanlistDict[key]=1
-    for k,v in list(renames.items()):
-        if checkIn(k,scanlistDict) or len(v)>1: # can't make sense of this one - just add the new stuff
-            for jj,kk in v: progList.append((0,jj,kk))
-        else: progList[proglistDict[k]]=(progList[proglistDict[k]][0],v[0][0],v[0][1])
-    # finally, separate off any with non-0 progress that are
-    # no longer available (keep them because they may come
-    # back later, but useful to make the distinction in case
-    # want to manually edit progress.txt)
-    n = 0 ; unavailList = []
-    while n<len(progList):
-        i,j,k = progList[n]
-        if not checkIn(norm_filelist(j,k), scanlistDict):
-            unavailList.append((i,j,k))
-            del progList[n]
-        else: n += 1
-    return unavailList
+            if not found: # new item
+                progList.append(item) ; self.keys.append(key)
+        else: # ditto
+            progList.append(item) ; self.keys.append(key)
+        self.scanlistDict[key]=1
+    def done(self):
+        # returns the list of items no longer available
+        progList,keys,proglistDict,scanlistDict = self.progList,self.keys,self.proglistDict,self.scanlistDict
+        for k,v in list(self.renames.items()):
+            if checkIn(k,scanlistDict) or len(v)>1: # can't make sense of this one - just add the new stuff
+                for jj,kk,key in v:
+                    progList.append((0,jj,kk)) ; keys.append(key)
+            else:
+                n = proglistDict[k]
+                progList[n]=(progList[n][0],v[0][0],v[0][1]) ; keys[n]=v[0][2]
+        # finally, separate off any with non-0 progress that are
+        # no longer available (keep them because they may come
+        # back later, but useful to make the distinction in case
+        # want to manually edit progress.txt)
+        stillAvail = [] ; unavailList = []
+        for n in xrange(len(progList)):
+            if checkIn(keys[n], scanlistDict): stillAvail.append(progList[n])
+            else: unavailList.append(progList[n])
+        progList[:] = stillAvail # (one pass, rather than del progList[n] for each one)
+        return unavailList
 
 def jitter(list):
     # Adds some random 'jitter' to a list (in-place)
@@ -541,6 +933,9 @@ def jitter(list):
     # items that have the same repetition count, but as this
     # gets large we rapidly tolerate increasing differences
     # in repetition count in the same group.
+    # (The output is built up in 'out' rather than by
+    # deleting and inserting, which was quadratic.)
+    out = [] ; copied = 0 # list[:copied] is already in out
     i = 0 ; groupStart = -1
     while i <= len(list):
         if i<len(list) and not list[i][0]: pass # leave it
@@ -551,11 +946,12 @@ def jitter(list):
             except OverflowError: incrementThreshold=sys.maxint
         elif groupStart>=0 and (i==len(list) or list[i][0] - list[groupStart][0] > incrementThreshold):
             l2 = list[groupStart:i] ; random.shuffle(l2)
-            del list[groupStart:i]
-            for item in l2: list.insert(groupStart,item)
-            groupStart = -1
+            l2.reverse() # (as we used to insert each item at groupStart, so keep the same order for the same random seed)
+            out += list[copied:groupStart] ; out += l2
+            copied = i ; groupStart = -1
             continue
         i += 1
+    out += list[copied:]
 
     # Handle 'limit' feature: Of the new words that are
     # limited, put all but limit_words of them at the end of
@@ -564,36 +960,38 @@ def jitter(list):
     # directory order not to introduce them too early)
     # -> latter has now been commented out because do sometimes
     # need to work on them more quickly, and can limit manually
-    limitCounts = {} ; i = 0 ; imax = len(list)
-    while i < imax:
-        if list[i][0]==0 and checkIn(list[i][-1],limitedFiles): # or not languageof(list[i][2])==secondLanguage):
-            # if not languageof(list[i][2])==secondLanguage: countNo="other-langs"
+    limitCounts = {} ; toEnd = []
+    list[:] = [] # will put back the ones not moved to the end
+    for item in out:
+        if item[0]==0 and checkIn(item[-1],limitedFiles): # or not languageof(item[2])==secondLanguage):
+            # if not languageof(item[2])==secondLanguage: countNo="other-langs"
             # else:
-            countNo = limitedFiles[list[i][-1]]
+            countNo = limitedFiles[item[-1]]
             if not checkIn(countNo,limitCounts): limitCounts [countNo] = 0
             limitCounts [countNo] += 1
             # (below is a hack: if already moved something, set limit_words to 1.  May want to do it better than that e.g. go back and ensure the first thing only left 1 as well, or share out limit_words among any concurrently available new items that are just about to be introduced)
-            if limitCounts [countNo] > cond(imax==len(list),limit_words,1) or (countNo=="other-langs" and limitCounts [countNo] > 1):
-                list.append(list[i])
-                del list[i]
-                imax -= 1 # don't re-check the ones already moved to the end
-                continue # no need to increment i
-        i += 1
+            if limitCounts [countNo] > cond(toEnd,1,limit_words) or (countNo=="other-langs" and limitCounts [countNo] > 1):
+                toEnd.append(item) ; continue
+        list.append(item)
+    list += toEnd
 
 def find_known_poems(progressData):
     # If every line of a poem is known then it might be better to recite the whole thing in sequence
-    # This function goes through progressData and extracts "known poems".  Returns: (a) a list of poems (each being a list of lines), (b) dictionary line -> index into progressData
+    # This function goes through progressData and extracts "known poems".  Returns: (a) a list of poems (each being a list of lines), (b) dictionary line -> index into progressData (for poem lines only)
     nextLineDic = {} # line -> next line
     responseIndex = {} # target response -> index into progressData
     hasPreviousLine = {} # line -> does it have a previous line
     for i in xrange(len(progressData)):
         response = progressData[i][2]
-        responseIndex[response] = i
         if type(progressData[i][1])==type([]): line=progressData[i][1][cond(len(progressData[i][1])==2,0,-1)] # (the L2 is normally in last position, but it's in 1st position in a 2-item list - see the "line 1 doesn't have L1 but line 2 does" comment)
         else: line=progressData[i][1]
         if languageof(line)==languageof(response) and not line==response: # looks like part of a poem (and not the 'beginning' first line).  (Don't need any extra code to avoid mistaking 2nd-language-to-2nd-language word pairs as poems, because responseIndex will not get the "first line" and the "poem" won't be viable.)
             nextLineDic[line]=response # TODO check what would happen if 2 different poems in vocab.txt share an identical line (or if responseIndex is ambiguous in any way)
             hasPreviousLine[response]=True
+    if nextLineDic: # index only the lines that can be in a poem, not every response in a large collection
+        for i in xrange(len(progressData)):
+            response = progressData[i][2]
+            if checkIn(response,nextLineDic) or checkIn(response,hasPreviousLine): responseIndex[response] = i
     poems = []
     for poemFirstLine in filter(lambda x,hasPreviousLine=hasPreviousLine:not x in hasPreviousLine,nextLineDic.keys()):
         poemLines = [] ; line = poemFirstLine
@@ -11,24 +11,20 @@
 
 # Start of loop.py - the main loop (not including Tk front-end etc)
 
-def doOneLesson(dbase):
+def doOneLesson(dbase,preplanned=None):
     global saveLesson
-    if dbase:
+    if preplanned: soFar,lesson = preplanned # (from load_preplanned)
+    elif dbase:
         soFar = dbase.message()
         lesson = dbase.makeLesson()
     else:
         soFar = "Re-loading saved lesson, so not scanning collection."
-        if compress_progress_file:
-            pp = os.popen('gzip -fdc "'+saveLesson+'"',popenRB)
-            if hasattr(pp,'buffer'): ppb = pp.buffer
-            else: ppb = pp
-            lesson=pickle.Unpickler(ppb).load()
-            del ppb,pp
-        else: lesson=pickle.Unpickler(open(saveLesson,'rb')).load()
+        lesson=pickle.loads(open_gunzip(saveLesson).read())
     if app and not dbase: app.setNotFirstTime()
     while 1:
       global cancelledFiles ; cancelledFiles = []
       global askAgain_explain ; askAgain_explain = ""
+      wait_for_preplan() # if hearing the lesson again, don't play it while the next one is being planned
       if not justSaveLesson:
         if emulated_interruptMain: check_for_interrupts() # (avoid confusion if cancel pressed before message shown)
         msg = soFar+"\n"+lesson.message() # +"\n(When you continue, there will be a 5 second delay\nto sit comfortably)"
@@ -48,19 +44,100 @@ def doOneLesson(dbase):
           if cancelledFiles: dbase.savePartial(cancelledFiles)
           else: dbase.save()
           if dbase.saved_completely and app: app.setNotFirstTime() # dbase.saved_completely could have been done by EITHER of the above (e.g. overlapping partial saves)
+          if preplan_lesson: start_preplan()
           if saveLesson:
-              if compress_progress_file:
-                  pp = os.popen('gzip -9 > "'+saveLesson+'"',popenWB)
-                  if hasattr(pp,'buffer'): ppb=pp.buffer
-                  else: ppb = pp
-                  pickle.Pickler(ppb,-1).dump(lesson) # TODO: paranoid_file_management ? (c.f. saveProgress)
-                  del ppb,pp
-              else: pickle.Pickler(open(saveLesson,"wb"),-1).dump(lesson)
+              f = SaveFile(saveLesson,compress_progress_file)
+              pickle.Pickler(f,-1).dump(lesson)
+              f.close()
               saveLesson = None # so saves only the first when doing multiple lessons
               if justSaveLesson: break
       if not app and not app==None: break # close box pressed
       if not waitBeforeStart or not getYN(cond(not askAgain_explain and (not dbase or not saveProgress or dbase.saved_completely),"Hear this lesson again?",askAgain_explain+"Start this lesson again?")): break
 
+# Planning the next lesson in the background (see preplan_lesson in advanced.txt).  Just after progress is saved, preplan does what lesson_loop would do at the start of the next lesson, and saves the lesson and the progress database's state in preplan_file() with a stamp of everything it depended on; load_preplanned uses it only if the stamp still matches.
+preplanFormat = (1,sys.version_info[0]) # increment if what's saved changes (and it's pickled, so Python 2 and 3 differ)
+# preplan shares the scan's globals (dirManifest, singleLinePoems, availablePrompts etc), the random generator and the current directory with the rest of gradint, so anything that scans samples, parses the vocab file, synthesizes, plays or changes directory calls wait_for_preplan first.
+preplan_lock = None # held while preplan runs
+def start_preplan():
+    global preplan_lock
+    wait_for_preplan()
+    if not (thread and pickle): return
+    preplan_lock = thread.allocate_lock() ; preplan_lock.acquire()
+    thread.start_new_thread(preplan,(preplan_lock,))
+def wait_for_preplan():
+    global preplan_lock
+    lock = preplan_lock
+    if not lock or thread.get_ident()==preplan_thread: return # (preplan itself scans etc)
+    lock.acquire() ; lock.release() # (release so other threads waiting on it aren't stuck)
+    preplan_lock = None
+def preplan(lock):
+    global preplan_thread,availablePrompts
+    preplan_thread = thread.get_ident()
+    try:
+      try:
+        if fileExists(preplan_file()): os.remove(preplan_file())
+        startTime = time.time()
+        init_scanSamples() ; availablePrompts = AvailablePrompts()
+        db = ProgressDatabase()
+        if db.data:
+            soFar = db.message() ; lesson = db.makeLesson()
+            db._close_database()
+            stamp = preplan_stamp(preplan_paths())
+            if not preplan_changed_since(stamp,startTime):
+                f = SaveFile(preplan_file(),compress_progress_file)
+                pickle.Pickler(f,-1).dump((preplanFormat,stamp)) # (separately, so load_preplanned needn't read the rest if it's out of date)
+                pickle.Pickler(f,-1).dump((soFar,is_first_lesson,db.data,db.unavail,db.promptsData,db.oldData,lesson))
+                f.close()
+      except IOError: pass # it's only to save time: the next lesson can be made in the usual way
+      except OSError: pass
+      except: show_warning("Could not plan the next lesson in advance: "+exc_info(False))
+    finally:
+        preplan_thread = None ; lock.release()
+def preplan_paths():
+    # The files and directories a lesson depends on.  Any file added, removed or renamed in a directory changes the directory's mtime, so we need check only the files whose contents matter (.txt files in samples and prompts are read while scanning).
+    paths = configFiles+[settingsFile,vocabFile,progressFile,pickledProgressFile,progress_journal_file(),progress_database_file()]
+    for d in list(dirManifest_used.keys()):
+        paths.append(d)
+        if checkIn(d,dirManifest): ls = dirManifest[d][1]
+        else:
+            try: ls = os.listdir(d)
+            except: ls = []
+        for f in ls:
+            if f.lower().endswith(dottxt): paths.append(d+os.sep+f)
+    return paths
+def preplan_stamp(paths):
+    stats = {}
+    for p in paths:
+        try:
+            s = os.stat(p) ; stats[p] = (s.st_size,s.st_mtime)
+        except: stats[p] = None
+    return (repr((firstLanguage,secondLanguage,otherLanguages,maxNewWords,maxLenOfLesson,sys.argv[1:],os.environ.get("Gradint_Extra_Options",""))),stats)
+def preplan_changed_since(stamp,t):
+    # True if anything in the stamp (other than progress, which preplan might have saved in a different form) changed after time t, so the lesson might not reflect the change
+    progress = list2set([progressFile,pickledProgressFile,progress_journal_file(),progress_database_file()])
+    for p,s in list(stamp[1].items()):
+        if s and s[1] >= t-2 and not checkIn(p,progress): return True # (-2 for mtime resolution)
+    return False
+def load_preplanned():
+    # Returns (dbase,preplanned for doOneLesson) if preplan saved a lesson and nothing has changed since, otherwise (None,None)
+    fname = preplan_file()
+    if not (preplan_lesson and pickle and fileExists(fname)): return None,None
+    r = None
+    try:
+        f = open_gunzip(fname)
+        format,stamp = pickle.Unpickler(f).load()
+        if format==preplanFormat and stamp==preplan_stamp(list(stamp[1].keys())): r = pickle.Unpickler(f).load()
+        f.close()
+    except: pass
+    try: os.remove(fname) # (it's for one lesson only)
+    except OSError: pass
+    if not r: return None,None
+    soFar,firstLesson,data,unavail,promptsData,oldData,lesson = r
+    dbase = ProgressDatabase(alsoScan=0) # (as preplan loaded it, since progress hasn't changed)
+    global is_first_lesson ; is_first_lesson = firstLesson
+    dbase.data,dbase.unavail,dbase.promptsData,dbase.oldData,dbase.didScan = data,unavail,promptsData,oldData,1
+    return dbase,(soFar,lesson)
+
 def disable_lid(restore): # for portable netbooks (like eee), can close lid & keep listening
   if unix:
    if app and not outputFile:
@@ -80,14 +157,17 @@ def lesson_loop():
   global app,availablePrompts,teacherMode
   if ask_teacherMode and not soundCollector and waitBeforeStart: teacherMode=getYN("Use teacher assistant mode? (say 'no' for self-study)")
   try:
+    wait_for_preplan()
     # doLabel("Scanning prompts") # rarely takes long even on low-end systems
     init_scanSamples() # in case was messed around with before
     availablePrompts = AvailablePrompts() # here so app is already initialised before any warnings
     global dbase # so can be accessed by interrupt handler
+    preplanned = None
     if loadLesson: dbase=None
     else:
         doLabel("Loading progress data")
-        dbase = ProgressDatabase()
+        dbase,preplanned = load_preplanned()
+        if not dbase: dbase = ProgressDatabase()
         if not dbase.data:
             msg = "There are no words to put in the lesson."
             if app or appuifw or android:
@@ -101,6 +181,6 @@ def lesson_loop():
                 primitive_synthloop()
             else: waitOnMessage(msg)
             return
-    doLabel("Making lesson")
-    doOneLesson(dbase)
+    if not preplanned: doLabel("Making lesson")
+    doOneLesson(dbase,preplanned)
   finally: teacherMode=0
@@ -362,7 +362,7 @@ if partialsDirectory and isDirectory(partialsDirectory):
       except IOError: pass # ignore write errors as it's only a cache
       except OSError: pass
   if partials_raw_mode:
-    (wtype,wrate,wchannels,wframes,wbits) = sndhdr.what(partialsDirectory+os.sep+"header"+dotwav)
+    (wtype,wrate,wchannels,wframes,wbits) = pcmInfo(partialsDirectory+os.sep+"header"+dotwav)[1]
     partials_raw_0bytes = int(betweenPhrasePause*wrate)*wchannels*(wbits/8)
 else: synth_partials_voices,partials_raw_mode = {},None
 
@@ -476,7 +476,7 @@ def optimise_partial_playing(ce):
         return s
     else: return ce # can't figure out an optimisation in these circumstances
 def simplified_header(fname):
-    h=sndhdr.what(fname)
+    h=soundInfo(fname)[1]
     # ignore num frames i.e. h[3], just compare formats
     if h: return h[:3]+h[4:]
 def optimise_partial_playing_list(ceList):
@@ -55,6 +55,7 @@ def play(event):
     if not lessonStartTime: lessonStartTime = time.time() # the actual time of the FIRST event (don't set it before as there may be delays).  (we're setting this at the END of the 1st event - the extra margin should be ok, and can help with start-of-lesson problems with slow disks.)
     if finishTime and time.time() >= emergency_lessonHold_to: doLabel("%s (finish %s)%s" % (time.strftime("%H:%M",time.localtime(time.time())),time.strftime("%H:%M",time.localtime(finishTime)),line2)) # was %I:%M but don't like leading '0' in PM times.  2nd condition added because might press 'brief interrupt' while playing.
 def doLabel(labelText):
+    if preplan_thread and thread.get_ident()==preplan_thread: return # (don't show the progress of planning the next lesson in the background)
     labelText = ensure_unicode(labelText)
     if app: app.setLabel(labelText)
     elif appuifw:
@@ -218,6 +219,7 @@ def changeToDirOf(file,winsound_also=0):
     # used before running a non-cygwin program in the cygwin environment (due to directory differences etc)
     # and (with winsound_also) before running a program on Windows without needing to quote the filename (e.g. because some versions of eSpeak won't write to a quoted wav file when called from popen).  Note windows os.chdir DOES change the drive also.  Use this only if filename will not contain special characters (e.g. should be able to use it for temp files).
     # NB if winsound_also is set, will return file "quoted" on other systems (so can set winsound_also and not worry about whether or not it should be quoted)
+    wait_for_preplan()
     file = S(file)
     if winCEsound and not ' ' in file: return file # don't need to quote
     elif winsound_also and not (winsound or mingw32 or cygwin): return '"'+file+'"'
@@ -267,7 +269,7 @@ class SampleEvent(Event):
     def __init__(self,file,useExactLen=False,isTemp=False):
         if use_unicode_filenames: file=ensure_unicode(file)
         self.file = file
-        self.exactLen = lengthOfSound(file)
+        self.exactLen = lengthOfSound(file,not isTemp)
         if isTemp: self.isTemp=1
         approxLen = self.exactLen
         if not lessonIsTight() and not useExactLen: approxLen = math.ceil(self.exactLen) # (if <=10min in lesson, don't round up to next second because we want a tighter fit)
@@ -286,6 +288,7 @@ class SampleEvent(Event):
         if hasattr(self,"is_prompt"): return not self.is_prompt # e.g. prompt from synth-cache
         return not B(self.file).startswith(B(promptsDirectory)) # (NB "not prompts" doesn't necessarily mean it'll be a sample - may be a customised additional comment)
     def play(self): # returns a non-{False,0,None} value on error
+        wait_for_preplan()
         if paranoid_file_management:
             if not hasattr(self,"isTemp"): open(self.file) # ensure ready for reading
         fileType=soundFileType(self.file)
@@ -363,8 +366,9 @@ class SampleEvent(Event):
             # sox distributed with Windows version needs redirection, but must do using < operator not cat (don't need to worry about this when playing because will use winsound.PlaySound, but NB it for SoundCollector etc)
             # riscos can't do re-direction (so hope not using a buggy sox) (but again don't have to worry about this if playing because will use PlayIt)
             # + on some setups (e.g. Linux 2.6 ALSA with OSS emulation), it can fail without returning an error code if the DSP is busy, which it might be if (for example) the previous event is done by festival and is taking slightly longer than estimated
-            t = time.time()
-            play_error = system('cat "%s" | sox -t %s - %s %s%s >/dev/null' % (S(self.file),fileType,sox_type,oss_sound_device,sox_effect))
+            t = time.time() ; cached = cached_pcm(self.file,fileType)
+            if cached: play_error = system('cat "%s" | sox %s - %s %s%s >/dev/null' % (cached,pcm_soxParams(44100),sox_type,oss_sound_device,sox_effect))
+            else: play_error = system('cat "%s" | sox -t %s - %s %s%s >/dev/null' % (S(self.file),fileType,sox_type,oss_sound_device,sox_effect))
             if play_error: return play_error
             else:
                 # no error, but did it take long enough?
@@ -374,6 +378,9 @@ class SampleEvent(Event):
                 if not app: show_info("play didn't take long enough - maybe ") # .. problem playing sound
                 return 1
         elif wavPlayer=="aplay" and ((not fileType=="mp3") or madplay_path or gotSox):
+            cached = cached_pcm(self.file,fileType)
+            if cached and sox_effect: return system('cat "'+cached+'" | sox '+pcm_soxParams(44100)+' - -t wav '+sox_16bit+' - '+sox_effect+' 2>/dev/null|aplay -q')
+            elif cached: return system('aplay -q -t raw -f S16_LE -r 44100 -c 1 "'+cached+'"')
             if madplay_path and fileType=="mp3": return system(madplay_path+' -q -A '+str(soundVolume_dB)+' "'+S(self.file)+'" -o wav:-|aplay -q') # changeToDirOf() not needed because this won't be cygwin (hopefully)
             elif gotSox and (sox_effect or fileType=="mp3"): return system('cat "'+S(self.file)+'" | sox -t '+fileType+' - -t wav '+sox_16bit+' - '+sox_effect+' 2>/dev/null|aplay -q') # (make sure o/p is 16-bit even if i/p is 8-bit, because if sox_effect says "vol 0.1" or something then applying that to 8-bit would lose too many bits)
             # (2>/dev/null to suppress sox "can't seek to fix wav header" problems, but don't pick 'au' as the type because sox wav->au conversion can take too long on NSLU2 (probably involves rate conversion))
@@ -405,57 +412,257 @@ br_tab=[(0 , 0 , 0 , 0 , 0),
 (416 , 320 , 256 , 224 , 144),
 (448 , 384 , 320 , 256 , 160),
 (0 , 0 , 0 , 0 , 0)]
-def rough_guess_mp3_length(fname):
-  try:
-    maybe_warn_mp3() # in case there's no mp3 player
-    # (NB this is only a rough guess because it doesn't support VBR
-    # and doesn't even check all sync bits.  It should be fairly quick though.)
-    o = open(fname,"rb") ; i = -1
+mp3_rates = [(44100,48000,32000),(22050,24000,16000),(11025,12000,8000)] # MPEG 1, 2, 2.5
+def mp3_frame(h,freeBitrate=0):
+    # Parses the 4-byte MP3 frame header h, returning (frame length in bytes, samples in frame, sample rate, MPEG version index into mp3_rates, is mono), or None if it isn't a valid header (or is 'free format', which we can't walk, unless freeBitrate is given to assume for it)
+    if len(h)<4 or not ord(h[0:1])==0xFF: return None
+    b1,b2,b3 = ord(h[1:2]),ord(h[2:3]),ord(h[3:4])
+    version,layer = (b1>>3)&3, 4-((b1>>1)&3) # version 3 = MPEG 1, 2 = MPEG 2, 0 = MPEG 2.5
+    brIndex,srIndex,padding = b2>>4, (b2>>2)&3, (b2>>1)&1
+    if b1 < 0xE0 or version==1 or layer==4 or brIndex==15 or srIndex==3: return None
+    if version==3: v,column = 0,layer-1 # MPEG 1 layer 1, 2 or 3
+    elif layer==1: v,column = cond(version==2,1,2),3 # MPEG 2+ layer 1
+    else: v,column = cond(version==2,1,2),4 # MPEG 2+ layer 2+
+    bitrate = br_tab[brIndex][column]*1000
+    if not bitrate: bitrate = freeBitrate
+    if not bitrate: return None
+    rate = mp3_rates[v][srIndex]
+    if layer==1: return (int(12*bitrate/rate)+padding)*4,384,rate,v,(b3>>6)==3
+    elif layer==3 and v: return int(72*bitrate/rate)+padding,576,rate,v,(b3>>6)==3
+    else: return int(144*bitrate/rate)+padding,1152,rate,v,(b3>>6)==3
+def mp3_int(s): # big-endian
+    r = 0
+    for c in range(len(s)): r = (r<<8) | ord(s[c:c+1])
+    return r
+mp3_walk_bytes = 262144 # max bytes of frames mp3_length reads when the file doesn't say how many frames it has
+def mp3_sync(buf,i,bufEnd):
+    # Returns the index of the first frame header at or after i that's followed by another (or by bufEnd, the end of the file's audio relative to buf), to avoid being thrown off by odd bytes before it, or -1
+    i = buf.find(LB("\xFF"),i)
+    while i >= 0:
+        fr = mp3_frame(buf[i:i+4])
+        if fr and (i+fr[0] >= bufEnd or (i+fr[0]+4 <= len(buf) and mp3_frame(buf[i+fr[0]:i+fr[0]+4]))): return i
+        i = buf.find(LB("\xFF"),i+1)
+    return -1
+def mp3_walk(buf,i):
+    # Returns (bytes,samples) of the complete frames in buf from i
+    totalBytes = totalSamples = 0
     while True:
-      head=o.read(512)
-      if len(head)==0: raise IndexError # read the whole file and not found a \xFF byte??
-      i=head.find(LB('\xFF'))
-      if i==-1: continue
-      if i+2 < len(head): head += o.read(3)
-      o.seek(o.tell()-len(head)+i+2) ; b=ord(head[i+1:i+2])
-      if b >= 0xE0: break # valid frame header starts w. 11 1-bits (not just 8: some files with embedded images could throw that off)
-    s = o.tell() ; o.close()
-    layer = 4-((b&6)>>1)
-    if b&24 == 24: # bits are 11 - MPEG version is 1
-      column = layer-1 # MPEG 1 layer 1, 2 or 3
-    elif layer==1: column = 3 # MPEG 2+ layer 1
-    else: column = 4 # MPEG 2+ layer 2+
-    bitrate = br_tab[ord(head[i+2:i+3])>>4][column]
-    if bitrate==0: bitrate=48 # reasonable guess for speech
-    return (filelen(fname)-s)*8.0/(bitrate*1000)
-  except IndexError: raise Exception("Invalid MP3 header in file "+repr(fname))
+        fr = mp3_frame(buf[i:i+4])
+        if not fr or i+fr[0] > len(buf): return totalBytes,totalSamples
+        totalBytes += fr[0] ; totalSamples += fr[1] ; i += fr[0]
+def mp3_free_length(buf,audioLen,fname):
+    # For 'free format' files (bitrate index 0, so the header doesn't give the frame length): measures the frame length as the distance to the next header, or if there isn't one, assumes 48kbps (a reasonable guess for speech)
+    i = buf.find(LB("\xFF"))
+    while i >= 0:
+        fr = mp3_frame(buf[i:i+4],48000)
+        if fr and not ord(buf[i+2:i+3])>>4: break
+        i = buf.find(LB("\xFF"),i+1)
+    if i < 0: raise Exception("Invalid MP3 header in file "+repr(fname))
+    frameLen,samplesPerFrame,rate = fr[:3]
+    j = buf.find(buf[i:i+2],i+4)
+    while j >= 0 and not (ord(buf[j+2:j+3])&0xFC)==(ord(buf[i+2:i+3])&0xFC): j = buf.find(buf[i:i+2],j+1) # (same bitrate and sample rate; padding can differ)
+    if j >= 0: frameLen = j-i
+    return (audioLen-i)*samplesPerFrame/float(frameLen*rate)
+def mp3_length(fname):
+    # Returns the length in seconds of an MP3 file.  Skips any ID3v2 tag, then uses the frame count in the Xing/Info header (with LAME's encoder delay and padding if present) or VBRI header, if the encoder wrote one (VBR files usually have one of these); otherwise walks the frames (all of them if the file's no bigger than mp3_walk_bytes, else 4 samples of a quarter of that spread through the file) and extrapolates from their average size.  (soundInfo caches the result by the file's size and mtime.)
+    maybe_warn_mp3() # in case there's no mp3 player
+    fileLen = filelen(fname)
+    o = open(fname,"rb")
+    try:
+        h = o.read(10) ; start = 0
+        if len(h)==10 and h[:3]==LB("ID3"):
+            start = 10+((ord(h[6:7])&0x7f)<<21)+((ord(h[7:8])&0x7f)<<14)+((ord(h[8:9])&0x7f)<<7)+(ord(h[9:10])&0x7f)
+            if ord(h[5:6])&0x10: start += 10 # footer
+        o.seek(start) ; buf = o.read(mp3_walk_bytes)
+        if len(buf)==mp3_walk_bytes: o.seek(fileLen-128) ; tail = o.read(3)
+        else: tail = buf[-128:-125]
+    finally: o.close()
+    if tail==LB("TAG"): fileLen -= 128 # ID3v1 tag at the end
+    i = mp3_sync(buf,0,fileLen-start)
+    if i < 0: return mp3_free_length(buf,fileLen-start,fname)
+    frameLen,samplesPerFrame,rate,v,mono = mp3_frame(buf[i:i+4])
+    # Xing/Info header (in the first frame, after the side information)
+    x = i+4+cond(v,cond(mono,9,17),cond(mono,17,32))
+    if buf[x:x+4] in [LB("Xing"),LB("Info")]:
+        flags = mp3_int(buf[x+4:x+8])
+        if flags&1:
+            frames = mp3_int(buf[x+8:x+12])
+            x += 8+4*(flags&1)+4*((flags>>1)&1)+100*((flags>>2)&1)+4*((flags>>3)&1) # start of LAME's extension
+            delay = 0
+            if buf[x:x+4]==LB("LAME") and len(buf) >= x+24:
+                d = mp3_int(buf[x+21:x+24])
+                delay = (d>>12)+(d&0xFFF) # samples of encoder delay + padding
+            return max(0,frames*samplesPerFrame-delay)/float(rate)
+    elif buf[i+36:i+40]==LB("VBRI"):
+        return mp3_int(buf[i+50:i+54])*samplesPerFrame/float(rate)
+    # No header: walk the frames
+    audioLen = fileLen-start-i
+    if len(buf) < mp3_walk_bytes: # we have the whole file
+        totalBytes,totalSamples = mp3_walk(buf,i)
+        if not totalBytes: return audioLen*samplesPerFrame/float(frameLen*rate) # (a truncated first frame)
+        return totalSamples/float(rate)
+    step = int(mp3_walk_bytes/4)
+    totalBytes,totalSamples = mp3_walk(buf[:step],i)
+    o = open(fname,"rb")
+    try:
+        for n in [1,2,3]:
+            o.seek(start+int((fileLen-start-step)*n/3.0))
+            s = o.read(min(step,fileLen-o.tell())) ; j = mp3_sync(s,0,len(s)+4)
+            if j < 0: continue
+            b,ns = mp3_walk(s,j) ; totalBytes += b ; totalSamples += ns
+    finally: o.close()
+    if not totalBytes: return audioLen*samplesPerFrame/float(frameLen*rate)
+    return totalSamples/float(rate)*audioLen/totalBytes # extrapolate to the rest of the file
 
 def filelen(fname):
     try: fileLen=os.stat(fname).st_size
     except: fileLen=len(read(fname))
     return fileLen
 
-def lengthOfSound(file):
-    if B(file).lower().endswith(B(dotmp3)): return rough_guess_mp3_length(file)
-    else: return pcmlen(file)
+def lengthOfSound(file,useCache=True): return soundInfo(file,useCache)[0]
 
-def pcmlen(file):
-    header = sndhdr.what(file)
+def pcmlen(file): return pcmInfo(file)[0]
+def pcmInfo(file,fileLen=None):
+    # returns (length in seconds, sndhdr-style header or None)
+    if fileLen==None: fileLen = filelen(file)
+    r = wav_info(file,fileLen)
+    if r: return r
+    if sndhdr: header = sndhdr.what(file) # other formats (while Python still has sndhdr)
+    else: header = None
     if not header:
-        # some Python 3 installations seem less able to run sndhdr
-        if gotSox: return len(readB(os.popen("sox \""+file+"\" -t raw "+sox_8bit+" "+sox_signed+" -c 1 -r 8000 - ",popenRB)))/8000.0
-        else: raise IOError("sndhdr can't analyse file '%s'" % (file,))
+        if gotSox: return len(readB(os.popen("sox \""+file+"\" -t raw "+sox_8bit+" "+sox_signed+" -c 1 -r 8000 - ",popenRB)))/8000.0, None
+        else: raise IOError("Can't analyse sound file '%s'" % (file,))
     (wtype,wrate,wchannels,wframes,wbits) = header
     if android:
         if wrate==6144: # might be a .3gp from android_recordFile
             d = open(file).read()
-            if 'mdat' in d: return (len(d)-d.index('mdat'))/1500.0 # this assumes the bitrate is roughly the same as in my tests, TODO figure it out properly
+            if 'mdat' in d: return (len(d)-d.index('mdat'))/1500.0, header # this assumes the bitrate is roughly the same as in my tests, TODO figure it out properly
     divisor = wrate*wchannels*wbits/8 # do NOT optimise with (wbits>>3), because wbits could be 4
     if not divisor: raise IOError("Cannot parse sample format of '%s': %s" % (file,repr(header)))
-    return (filelen(file) - 44.0) / divisor # 44 is a typical header length, and .0 to convert to floating-point
+    return (fileLen - 44.0) / divisor, header # 44 is a typical header length, and .0 to convert to floating-point
+
+def wav_info(file,fileLen):
+    # Reads the chunks of a RIFF/WAVE file up to its data chunk (usually in one read of 512 bytes), and returns (length in seconds, header) where header is ('wav',rate,channels,frames,bits) as sndhdr.what would give for PCM, or None for compressed formats.  Returns None if it's not a WAV file or the chunks don't make sense (e.g. truncated before the data chunk), in which case pcmInfo tries other ways.  Unlike sndhdr, the length is from the data chunk's size (not the file size), so LIST chunks etc after the data don't count.
+    if not struct: return None
+    try: f = open(file,"rb")
+    except IOError: return None
+    try:
+        buf = f.read(512) ; bufStart = 0
+        if len(buf)<12 or not buf[:4]==LB("RIFF") or not buf[8:12]==LB("WAVE"): return None
+        pos = 12 ; fmt = fact = None
+        for chunkNo in xrange(64): # (a WAV file shouldn't have anywhere near this many chunks before its data)
+            if pos+48 > bufStart+len(buf) and bufStart+len(buf) < fileLen: # chunk header (and any fmt or fact contents) not all in buf
+                f.seek(pos) ; buf = f.read(512) ; bufStart = pos
+            i = pos-bufStart
+            if len(buf) < i+8: return None # truncated
+            chunk,size = buf[i:i+4],struct.unpack("<L",buf[i+4:i+8])[0]
+            if chunk==LB("fmt ") and size>=16: fmt = buf[i+8:i+8+min(size,40)]
+            elif chunk==LB("fact") and size>=4: fact = buf[i+8:i+12]
+            elif chunk==LB("data"): break
+            pos += 8+size+(size&1) # (chunks are padded to even length)
+        else: return None
+    finally: f.close()
+    if not fmt or len(fmt)<16: return None
+    formatTag,channels,rate,byteRate,blockAlign,bits = struct.unpack("<HHLLHH",fmt[:16])
+    if formatTag==0xFFFE and len(fmt)>=26: formatTag = struct.unpack("<H",fmt[24:26])[0] # WAVE_FORMAT_EXTENSIBLE: the real format is at the start of the SubFormat GUID
+    if not channels or not rate: return None
+    dataLen = fileLen-pos-8
+    if 0 < size < dataLen: dataLen = size # (size is 0 or too big if the writer couldn't seek back to fill it in, or if the file is truncated)
+    if dataLen < 0: return None
+    if formatTag==1: # PCM
+        width = int((bits+7)/8)
+        if not width: return None
+        frames = int(dataLen/(channels*width))
+        return frames/float(rate), ('wav',rate,channels,frames,width*8)
+    if fact and len(fact)==4: return struct.unpack("<L",fact)[0]/float(rate), None # compressed formats should say how many samples
+    if byteRate: return dataLen/float(byteRate), None
+    return None
+
+# Sound metadata cache: lengthOfSound and simplified_header are called many times per lesson on the same prompts and samples, and re-reading all those headers can take most of makeLesson's time on a large collection (especially over a network filesystem).  So keep (size,mtime) -> (length,header) for each file, and keep it between runs.
+soundInfoCache_file = "soundinfo-cache"+extsep+"bin"
+soundInfoCacheFormat = 3 # increment if the format of the values changes (or how they are calculated)
+soundInfoCache = {} ; soundInfoCache_changed = 0
+if pickle and fileExists(soundInfoCache_file):
+    try:
+        format,values = pickle.Unpickler(open(soundInfoCache_file,"rb")).load()
+        if format==soundInfoCacheFormat: soundInfoCache = values
+        del format,values
+    except MemoryError: raise
+    except: pass # e.g. written by a different Python version: just re-read the headers
+def soundInfo(file,useCache=True):
+    # returns (length,header) where header is as sndhdr.what gives (or None for MP3 etc).  Set useCache=False for temporary files (their names are re-used).
+    global soundInfoCache_changed
+    st = None
+    if useCache:
+        try: st = os.stat(file)
+        except: pass # we'll let the header-reading code report the error
+    if st:
+        k,sig = B(file),(st.st_size,st.st_mtime)
+        r = soundInfoCache.get(k,None)
+        if r and r[0]==sig: return r[1]
+        fileLen = st.st_size
+    else: fileLen = None
+    if B(file).lower().endswith(B(dotmp3)): r = (mp3_length(file),None)
+    else: r = pcmInfo(file,fileLen)
+    if st:
+        soundInfoCache[k] = (sig,r)
+        soundInfoCache_changed = 1
+    return r
+def save_soundInfoCache():
+    global soundInfoCache_changed
+    if not soundInfoCache_changed or not pickle: return
+    try:
+        f = SaveFile(soundInfoCache_file) # (so an interrupted or concurrent save can't leave it truncated)
+        pickle.Pickler(f,-1).dump((soundInfoCacheFormat,soundInfoCache)) ; f.close()
+    except IOError: pass # ignore write errors as it's only a cache
+    except OSError: pass
+    soundInfoCache_changed = 0
 
 ##########################################################
 
+silenceChunk = 65536 # bytes of zeros SoundCollector writes at a time
+try: buffer # Python 2 (and its file objects accept these even in text mode, unlike memoryview)
+except NameError:
+    def buffer(b,offset,size): return memoryview(b)[offset:offset+size]
+beepTable = {} # beep command -> its audio, so sox runs once per kind of beep rather than for every beep
+try: import Queue as queue
+except ImportError:
+    try: import queue
+    except ImportError: queue = None
+writerQueueLen = 32 # max chunks SoundCollector can be ahead of its encoder (chunks are up to 100k, or a whole sample)
+class WriterThread(object):
+    # File-like object that hands what's written to a thread that writes it to o, so SoundCollector can carry on decoding and rendering the next events while the encoder catches up.  Written data must not change afterwards (bytes, buffers of them, or mmaps that aren't closed).
+    def __init__(self,o):
+        self.o,self.error,self.closed = o,0,0
+        self.queue = queue.Queue(writerQueueLen)
+        self.done = thread.allocate_lock() ; self.done.acquire()
+        thread.start_new_thread(self.run,())
+    def run(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None: break
+                if not self.error: # (but keep taking from the queue so write() can't block)
+                    try: writeB(self.o,data)
+                    except: self.error = 1
+        finally: self.done.release()
+    def write(self,data):
+        if self.error: raise IOError("write error")
+        self.queue.put(data)
+    def close(self):
+        if self.closed: return
+        self.closed = 1 ; self.queue.put(None) ; self.done.acquire()
+        if self.error:
+            try: self.o.close()
+            except IOError: pass
+            raise IOError("write error")
+        self.o.close()
+    def abort(self):
+        # Discards anything not yet written, stops the thread and closes o (so an encoder gets end-of-file)
+        if self.closed: return
+        self.error = 1 # (the thread discards the rest of the queue)
+        try: self.close()
+        except IOError: pass
 class SoundCollector(object):
     def __init__(self):
         self.rate = 44100 # so ok for oggenc etc
@@ -483,9 +690,11 @@ class SoundCollector(object):
         else: self.o = open(outputFile,"wb")
         self.theLen = 0
         self.silences = []
+        if thread and queue and writerQueueLen and not outputFile=="-": self.o = WriterThread(self.o)
+        self.zeros = chr(0)*silenceChunk # written (via buffer, which doesn't copy) for all silences, so a long gap doesn't need a long string
     def soxParams(self):
         # Have 16-bit mono, signed, little-endian
-        return ("-t raw "+sox_16bit+" "+sox_signed+" -r %d -c 1" % (self.rate,))+sox_little_endian
+        return pcm_soxParams(self.rate)
     def tell(self):
         # How many seconds have we had?  (2 because 16-bit)
         return 1.0*self.theLen/self.rate/2
@@ -496,11 +705,23 @@ class SoundCollector(object):
         sampleNo = int(0.5+seconds*self.rate)
         if not sampleNo: sampleNo=1 # so don't lock on rounding errors
         byteNo = sampleNo*2 # since 16-bit
-        outfile_writeBytes(self.o,chr(0)*byteNo)
         self.theLen += byteNo
+        while byteNo > silenceChunk:
+            outfile_writeBytes(self.o,self.zeros)
+            byteNo -= silenceChunk
+        outfile_writeBytes(self.o,buffer(self.zeros,0,byteNo))
     def addFile(self,file,length): # length ignored in this version
         fileType=soundFileType(file)
+        if thePcmCache and not fileType=="wav":
+            cached = thePcmCache.get(file,self.rate)
+            if cached:
+                self.theLen += thePcmCache.write_to(self.o,cached) ; return
         if fileType=="mp3": file,fileType = theMp3FileCache.decode_mp3_to_tmpfile(file),"wav" # in case the system needs madplay etc rather than sox
+        if fileType=="wav":
+            data = native_pcm16(file,self.rate)
+            if data: # converted in-process, no need to start a sox for this one
+                outfile_writeBytes(self.o,data)
+                self.theLen += len(data) ; return
         if riscos_sound:
             system("sox -t %s \"%s\" %s tmp0" % (fileType,file,self.soxParams()))
             handle=open("tmp0","rb")
@@ -514,10 +735,14 @@ class SoundCollector(object):
         while gap > betweenBeeps+0.05:
             t1 = self.tell()
             self.addSilence(betweenBeeps/2.0)
-            if riscos_sound:
-                system(beepCmd(self.soxParams(),"tmp0"))
-                data=read("tmp0") ; os.unlink("tmp0")
-            else: data=readB(os.popen(beepCmd(self.soxParams(),"-"),popenRB))
+            cmd = beepCmd(self.soxParams(),cond(riscos_sound,"tmp0","-")) # (includes the rate, waveform, frequency and length)
+            data = beepTable.get(cmd,None)
+            if not data:
+                if riscos_sound:
+                    system(cmd)
+                    data=read("tmp0") ; os.unlink("tmp0")
+                else: data=readB(os.popen(cmd,popenRB))
+                beepTable[cmd] = data
             outfile_writeBytes(self.o,data)
             self.theLen += len(data)
             self.addSilence(betweenBeeps/2.0)
@@ -535,6 +760,15 @@ class SoundCollector(object):
             else: ttl += self.silences[i]
         if not app: show_info("Lengths of silences: %s (total %s)\n" % (self.silences,ttl))
         if not outputFile=="-": outfile_close(self.o)
+        self.o = None
+    def abort(self):
+        # For a lesson that won't be finished (exception, or the collector being discarded): closes the output without finishing it, so a WriterThread and the encoder don't wait forever for the rest
+        o,self.o = self.o,None
+        if not o or o==sys.stdout: return
+        try:
+            if hasattr(o,"abort"): o.abort()
+            else: o.close()
+        except IOError: pass
 def outfile_writeBytes(o,bytes):
     try: writeB(o,bytes)
     except IOError: outfile_write_error()
@@ -549,6 +783,43 @@ def outfile_writeFile(o,handle,filename):
         theLen += len(data)
     if not B(filename).startswith(B(partialsDirectory+os.sep)): assert theLen, "No data when reading "+S(filename)+": check for sox crash" # (but allow empty partials e.g. r5.  TODO if it's from EkhoSynth it could be a buggy version of Ekho)
     return theLen
+try: import wave
+except: wave = None
+try: import array
+except: array = None
+try: import audioop # (not in Python 3.13+: we fall back to array operations)
+except: audioop = None
+def native_pcm16(file,rate):
+    # Returns a WAV file's audio as 16-bit signed little-endian mono at 'rate', converted without starting sox, or None if it has to be left to sox (compressed WAV, multichannel, unusual sample widths etc)
+    if not wave or not array or big_endian: return None
+    try:
+        w = wave.open(S(file),"rb")
+        try:
+            channels,width,inRate = w.getnchannels(),w.getsampwidth(),w.getframerate()
+            data = w.readframes(w.getnframes())
+        finally: w.close()
+    except: return None # wave.Error, EOFError etc
+    frameSize = channels*width
+    data = data[:len(data)-len(data)%frameSize]
+    if not data or channels>2 or inRate<=0: return None
+    if not audioop and not inRate==rate: return None # resampling in pure Python is slower than letting sox do it
+    if audioop:
+        try:
+            if width==1: data = audioop.bias(data,1,-128) # WAV's 8-bit is unsigned
+            if not width==2: data = audioop.lin2lin(data,width,2)
+            if channels==2: data = audioop.tomono(data,2,0.5,0.5)
+            if not inRate==rate: data = audioop.ratecv(data,2,1,inRate,rate,None)[0]
+        except audioop.error: return None # e.g. 24-bit on Python 2, whose audioop does only widths 1, 2 and 4: leave it to sox
+        return data
+    if width==1: a = array.array('h',[(b-128)<<8 for b in bytearray(data)])
+    elif width==2:
+        a = array.array('h')
+        if hasattr(a,"frombytes"): a.frombytes(data)
+        else: a.fromstring(data)
+    else: return None
+    if channels==2: a = array.array('h',[(l+r)>>1 for l,r in zip(a[0::2],a[1::2])])
+    if hasattr(a,"tobytes"): return a.tobytes()
+    else: return a.tostring()
 def outfile_write_error(): raise IOError("Error writing to outputFile: either you are missing an encoder for "+out_type+", or the disk is full or something.")
 def oggenc(): # 2016: some Windows builds are now called oggenc2
     global cached_oggenc
@@ -662,6 +933,8 @@ tail -1 "$S" | bash\nexit\n""" % (sox_16bit,sox_signed) # S=script P=params for
         if not write_to_stdout:
             outfile_close(self.o)
             if unix: os.system("chmod +x \"%s\"" % (outputFile,))
+    def abort(self):
+        if not write_to_stdout: self.o.close()
 def dd_command(offset,length):
     if not length: return []
     gcd,b = offset,length
@@ -679,6 +952,7 @@ def warn_sox_decode():
         if r: show_warning('; '.join(r))
         warned_about_sox_decode = 1
 def decode_mp3(file): # Returns WAV data including header.  TODO: this assumes it's always small enough to read the whole thing into RAM (should be true if it's 1 word though, and decode_mp3 isn't usually used unless we're making a lesson file rather than running something in justSynthesize)
+    wait_for_preplan()
     file = S(file)
     if riscos_sound:
         warn_sox_decode() # TODO: can use madplay or AMPlay to decode if correctly installed
@@ -730,6 +1004,150 @@ class Mp3FileCache(object):
         return self.fileCache[file]
 theMp3FileCache = Mp3FileCache()
 
+# Decoded-PCM cache (see pcmCache in advanced.txt): compressed samples would otherwise be decoded by madplay, sox etc every time they're played or collected, so keep their audio as raw 16-bit signed little-endian mono, named by a hash of the file's contents and the sample rate, read back with mmap where available.  Least recently used entries (by mtime, which get() updates) are removed when it gets bigger than pcmCacheSize megabytes.
+try: import mmap
+except: mmap = None
+try: from hashlib import md5
+except:
+    try: from md5 import md5
+    except: md5 = None
+def pcm_soxParams(rate): return ("-t raw "+sox_16bit+" "+sox_signed+" -r %d -c 1" % (rate,))+sox_little_endian
+def decode_pcm16(file,rate):
+    # Returns a sound file's audio as 16-bit signed little-endian mono at 'rate' (decoded as SoundCollector would), or None if that fails
+    fileType,tmp = soundFileType(file),None
+    if fileType=="mp3":
+        data = decode_mp3(file)
+        if not data: return None
+        tmp = os.tempnam()+dotwav ; write(tmp,data)
+        file,fileType = tmp,"wav"
+    try:
+        data = None
+        if fileType=="wav": data = native_pcm16(file,rate)
+        if not data:
+            if winsound or mingw32: data = readB(os.popen(("sox -t %s - %s - < \"%s\"" % (fileType,pcm_soxParams(rate),file)),popenRB))
+            else: data = readB(os.popen(("cat \"%s\" | sox -t %s - %s -" % (S(file),fileType,pcm_soxParams(rate))),popenRB))
+    finally:
+        if tmp: os.remove(tmp)
+    return data
+pcmCacheFormat = (1,sys.version_info[0]) # of the index (it's pickled)
+class PcmCache(object):
+    # Entries are named by the md5 of the sample's contents, and an index (saved next to the directory) maps each sample's path, size and mtime to its md5 so a hit needn't read and hash the whole sample.  Players use only existing entries: on a miss they play the sample as usual and it's decoded into the cache in the background, as decoding first would delay the start of playback.
+    def __init__(self,directory,maxBytes):
+        self.dir,self.maxBytes = directory,maxBytes
+        self.hits = self.misses = 0
+        self.totalBytes = None # counted when first needed
+        self.index,self.indexChanged = None,0 # loaded when first needed
+        self.toFill,self.filling = [],0 # for fill_later
+    def indexFile(self): return self.dir+"-index"+extsep+"bin"
+    def entry(self,file,rate):
+        # Returns the filename of file's entry at 'rate' (whether or not it exists yet), or None if file can't be read
+        if self.index==None:
+            self.index = {}
+            if pickle and fileExists(self.indexFile()):
+                try:
+                    format,values = pickle.Unpickler(open(self.indexFile(),"rb")).load()
+                    if format==pcmCacheFormat: self.index = values
+                except MemoryError: raise
+                except: pass # just hash again
+        try: st = os.stat(file)
+        except OSError: return None
+        k,sig = B(file),(st.st_size,st.st_mtime)
+        r = self.index.get(k,None)
+        if r and r[0]==sig: digest = r[1]
+        else:
+            try: digest = md5(read(file)).hexdigest()
+            except IOError: return None
+            self.index[k] = (sig,digest) ; self.indexChanged = 1
+        return self.dir+os.sep+digest+"-"+str(rate)+extsep+"raw"
+    def get(self,file,rate,decode=True,count=True):
+        # Returns the filename of file's decoded audio at 'rate', or None if it can't be decoded.  If it's not in the cache, it's decoded into it first, unless decode is False in which case None is returned.  count is False if it's not to be counted in the hit rate.
+        fname = self.entry(file,rate)
+        if not fname: return None
+        if fileExists(fname):
+            try:
+                os.utime(fname,None) # most recently used
+                if count: self.hits += 1
+                return fname
+            except OSError: pass # removed by another instance's evict()
+        if count: self.misses += 1
+        if not decode: return None
+        data = decode_pcm16(file,rate)
+        if not data: return None
+        self.evict(len(data))
+        try:
+            if not isDirectory(self.dir): os.mkdir(self.dir)
+            write(fname+extsep+"tmp",data) ; os.rename(fname+extsep+"tmp",fname)
+        except (IOError,OSError): return None # e.g. read-only
+        self.totalBytes += len(data)
+        return fname
+    def fill_later(self,file,rate):
+        # Decodes file into the cache in a background thread (one at a time, so it doesn't compete too much with playback)
+        if not thread or cygwin: return # (decoding can change directory on Cygwin)
+        if (file,rate) in self.toFill: return
+        self.toFill.append((file,rate))
+        if not self.filling:
+            self.filling = 1 ; thread.start_new_thread(self.fill,())
+    def fill(self):
+        try:
+            while self.toFill:
+                file,rate = self.toFill[0]
+                try: self.get(file,rate,count=False)
+                except (IOError,OSError): pass # it's only a cache: the sample will be decoded again next time
+                except: show_warning("Could not cache the decoded audio of "+S(file)+": "+exc_info(False))
+                del self.toFill[0]
+        finally: self.filling = 0
+    def evict(self,needed):
+        # Makes room for 'needed' more bytes, going down to 90% of maxBytes so we don't list the directory for every new entry once it's full
+        if self.totalBytes==None or self.totalBytes+needed > self.maxBytes:
+            l = []
+            if isDirectory(self.dir):
+                for f in os.listdir(self.dir):
+                    f = self.dir+os.sep+f
+                    try: st = os.stat(f)
+                    except OSError: continue
+                    l.append((st.st_mtime,st.st_size,f))
+            l.sort() ; l.reverse()
+            self.totalBytes = 0
+            for t,size,f in l: self.totalBytes += size
+            while l and self.totalBytes+needed > self.maxBytes*0.9:
+                t,size,f = l.pop()
+                try: os.remove(f)
+                except OSError: continue
+                self.totalBytes -= size
+    def write_to(self,o,fname):
+        # Writes a cache entry to outfile o and returns its length
+        f = open(fname,"rb")
+        try:
+            if mmap:
+                try: m = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+                except: m = None # e.g. empty, or mmap not supported here
+                if m: # (not closed here, as o might be a WriterThread that hasn't written it yet: it's unmapped when the last reference goes)
+                    outfile_writeBytes(o,m) ; return len(m)
+            data = f.read() ; outfile_writeBytes(o,data) ; return len(data)
+        finally: f.close()
+    def report(self):
+        if self.hits+self.misses: show_info("Decoded-audio cache: %d hits, %d misses (%d%% hit rate)\n" % (self.hits,self.misses,int(100.0*self.hits/(self.hits+self.misses))))
+        self.hits = self.misses = 0
+    def save(self):
+        # Finishes the sample being filled (dropping any others, as the lesson's over) and saves the index if it's changed
+        del self.toFill[1:]
+        while self.filling: time.sleep(0.1)
+        if not self.indexChanged or not pickle: return
+        self.indexChanged = 0
+        try:
+            f = SaveFile(self.indexFile())
+            pickle.Pickler(f,-1).dump((pcmCacheFormat,self.index.copy())) ; f.close()
+        except IOError: pass # ignore write errors as it's only a cache
+        except OSError: pass
+if pcmCache and pcmCacheSize and md5 and not (riscos_sound or winCEsound or appuifw or android): thePcmCache = PcmCache(pcmCache,int(pcmCacheSize*1048576))
+else: thePcmCache = None
+def cached_pcm(file,fileType,rate=44100):
+    # For players: the filename of a compressed file's decoded audio in thePcmCache (see above), or None if it's not there yet
+    if thePcmCache and gotSox and not fileType=="wav":
+        r = thePcmCache.get(file,rate,False)
+        if not r: thePcmCache.fill_later(file,rate)
+        return r
+
 # -----------------------------------------------------
 
 soundCollector = None # by default don't do this
@@ -14,7 +14,7 @@
 def randomInstruction(numTimesBefore,promptsData,language):
     if not numTimesBefore: return (availablePrompts.getPromptList("repeatAfterMe",promptsData,language),0)
     if numTimesBefore==1: return (availablePrompts.getPromptList("sayAgain",promptsData,language),1)
-    if (dbase.veryExperienced() and numTimesBefore>=reallyKnownThreshold) or (meaningTestThreshold and numTimesBefore>meaningTestThreshold and not random.choice([1,2,3])==1):
+    if (planningDbase.veryExperienced() and numTimesBefore>=reallyKnownThreshold) or (meaningTestThreshold and numTimesBefore>meaningTestThreshold and not random.choice([1,2,3])==1):
         if language==secondLanguage: return (None,1) # no instruction needed
         else: return (availablePrompts.getPromptList(language,promptsData,language),1) # just need the language name
     r = availablePrompts.getRandomPromptList(promptsData,language)
@@ -999,6 +999,7 @@ getsynth_cache = {}
 def setSoundCollector(sc):
     # for GUI etc - need to reset the available synths when changing it
     global soundCollector, viable_synths, getsynth_cache
+    if soundCollector and not soundCollector==sc: soundCollector.abort() # (no-op if it's finished; otherwise its lesson was abandoned)
     soundCollector,viable_synths,getsynth_cache = sc,[],{}
 def get_synth_if_possible(language,warn=1,to_transliterate=False):
     language = S(language)
@@ -1164,6 +1165,7 @@ def abspath_from_start(p): # for just_synthesize to check for paths relative to
 
 def just_synthesize(callSanityCheck=0,lastLang_override=None):
     # Handle the justSynthesize setting (see advanced.txt)
+    wait_for_preplan()
     global startAnnouncement,endAnnouncement,logFile,synth_partials_cache
     synth_partials_cache = {} # to stop 'memory leak' when running from the GUI
     oldStart,oldEnd,oldLogfile = startAnnouncement,endAnnouncement,logFile
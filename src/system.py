@@ -89,8 +89,10 @@ def show_warning(w):
     warnings_printed.append(w+"\n")
     if app==False: warnings_toprint.append(w) # may need to output them if app/appuifw/android turns out not to be created
 
+preplan_thread = None # thread id of preplan (in loop.py) while it's running, so it can plan quietly
 def show_info(i,always_stderr=False):
     # == sys.stderr.write(i) with no \n and no error if closed (+ redirect to app or appuifw if exists)
+    if preplan_thread and thread.get_ident()==preplan_thread: return
     if (app or appuifw or android) and not always_stderr: return doLabel(i)
     if not riscos_sound and not always_stderr and hasattr(sys.stderr,"isatty") and not sys.stderr.isatty(): return # be quiet if o/p is being captured by cron etc (but isatty() might always return false on RISC OS
     if winCEsound and len(i)>101: i=i[:100]+"..."+i[-1] # otherwise can hang winCEsound's console
@@ -107,6 +109,17 @@ except: struct=0
 if struct and B(struct.pack("h",1)[0])==B('\x00'): big_endian = 1
 else: big_endian = 0
 
+try: import thread
+except ImportError:
+    try: import _thread as thread
+    except ImportError: thread = None
+
+# Compact list of integers (e.g. indices into the progress data) if we have the array module, otherwise a normal list
+try:
+    import array
+    def indexArray(l): return array.array('l',l)
+except: indexArray = list
+
 # RISC OS has a different extension separator because "." is used as a directory separator (from the original 1982 BBC Micro DFS with 1-character directories)
 if hasattr(os,'extsep'): extsep = os.extsep
 elif riscos_sound: extsep = "/"
@@ -224,7 +237,9 @@ if not fileExists(configFiles[0]):
 
 # directory should be OK by now
 if sys.platform.find("ymbian")>-1: sys.path.insert(0,os.getcwd()+os.sep+"lib")
-import time,sched,sndhdr,random,math,pprint,codecs
+import time,sched,random,math,pprint,codecs
+try: import sndhdr # (not in Python 3.13+: WAV files are read by wav_info in play.py, and sndhdr is needed only for other formats)
+except: sndhdr = None
 
 def exc_info(inGradint=True):
     import sys # in case it's been gc'd
@@ -449,6 +464,15 @@ elif (macsound or sys.platform.lower().find("bsd")>0) and os.environ.get("TMPDIR
     tempnam0 = os.tempnam
     os.tempnam=lambda *args:tempnam0(os.environ["TMPDIR"])
 
+def progress_journal_file(): return progressFile+"-journal" # (see progress_journal in advanced.txt)
+def progress_database_file(): return progressFile+"-db" # (see progress_database in advanced.txt)
+def preplan_file(): return progressFile+"-next" # (see preplan_lesson in advanced.txt)
+def progress_mtime(): # when progress was last saved (progressFile may be older than its journal or database)
+    t = os.stat(progressFile).st_mtime
+    for f in [progress_journal_file(),progress_database_file()]:
+        if fileExists(f): t = max(t,os.stat(f).st_mtime)
+    return t
+
 if disable_once_per_day==1:
   if once_per_day==3: sys.exit()
   else: once_per_day=0
@@ -487,7 +511,7 @@ if once_per_day&2 and not hasattr(sys,"_gradint_innerImport"): # run every day
       if len(sys.argv)>1: sys.argv.append(";")
       sys.argv.append("disable_once_per_day=0") # don't let a disable_once_per_day=2 in argv result in repeated questioning
      time.sleep(3600) # delay 1 hour at a time (in case hibernated)
-if once_per_day&1 and fileExists(progressFile) and time.localtime(os.stat(progressFile).st_mtime)[:3]==time.localtime()[:3]: sys.exit() # already run today
+if once_per_day&1 and fileExists(progressFile) and time.localtime(progress_mtime())[:3]==time.localtime()[:3]: sys.exit() # already run today
 try: orig_onceperday
 except: orig_onceperday=0
 
@@ -597,6 +621,104 @@ except:
   except: pickle = None
 try: import re
 except: re = None
+try: import gzip,zlib
+except: gzip = zlib = None
+def open_gunzip(fname): # like 'gzip -fdc': read fname, decompressing it if it's gzipped
+    if paranoid_file_management: open(fname) # ensure ready
+    f = open(fname,"rb")
+    if not f.read(2)==LB("\x1f\x8b"):
+        f.seek(0) ; return f
+    f.seek(0)
+    if zlib: return GunzipReader(f)
+    f.close() ; f = os.popen('gzip -fdc "'+fname+'"',popenRB) # no zlib module
+    if hasattr(f,"buffer"): f=f.buffer # Python 3 non-"b" file
+    return f
+class GunzipReader(object):
+    # read() and readline() of a gzipped file, decompressing a chunk at a time (much faster than GzipFile on Python 2)
+    def __init__(self,f):
+        self.f,self.buf,self.pos = f,B(""),0
+        self.z = zlib.decompressobj(16+zlib.MAX_WBITS) # (16 = expect gzip header)
+    def more(self):
+        if not self.f: return False
+        chunk = self.f.read(65536)
+        if chunk: data = self.z.decompress(chunk)
+        else:
+            data = self.z.flush() ; self.f.close() ; self.f = None
+        self.buf = self.buf[self.pos:]+data ; self.pos = 0
+        return True
+    def read(self,n=-1):
+        if n<0:
+            while self.more(): pass
+        else:
+            while len(self.buf)-self.pos < n and self.more(): pass
+        if n<0: n=len(self.buf)
+        r = self.buf[self.pos:self.pos+n] ; self.pos += len(r)
+        return r
+    def readline(self):
+        i = self.buf.find(B("\n"),self.pos)
+        while i==-1:
+            start = len(self.buf)-self.pos
+            if not self.more(): break
+            i = self.buf.find(B("\n"),start)
+        if i==-1: i=len(self.buf)
+        else: i += 1
+        r = self.buf[self.pos:i] ; self.pos = i
+        return r
+    def close(self):
+        if self.f: self.f.close()
+class SaveFile(object):
+    # Binary file for saving fname (gzipped if compress): it's written to a temporary file which replaces fname only when close() succeeds, so an interrupted or failed save can't leave fname truncated.  If writing fails, or the SaveFile is dropped without close(), the temporary file is removed.
+    def __init__(self,fname,compress=0):
+        self.fname = fname
+        if paranoid_file_management: self.tmp = os.tempnam() # on some ftpfs setups rename is unreliable, so copy it over with write() when done
+        else: self.tmp = fname+"-tmp" # (not -new: server/gradint.cgi uses progressFile-new for something else)
+        self.raw = open(self.tmp,"wb")
+        if compress and gzip: self.f = gzip.GzipFile("","wb",compress_progress_level,self.raw)
+        else: self.f = self.raw
+        self.compressLater = compress and not gzip
+        self.buf,self.bufLen = [],0 # (GzipFile is slow with lots of small writes)
+    def write(self,data):
+        self.buf.append(data) ; self.bufLen += len(data)
+        if self.bufLen > 65536:
+            ok = 0
+            try:
+                self.flush() ; ok = 1
+            finally:
+                if not ok: self.abort()
+    def flush(self):
+        self.f.write(B("").join(self.buf)) ; self.buf,self.bufLen = [],0
+    def close(self):
+        ok = 0
+        try:
+            self.flush()
+            if not self.f==self.raw: self.f.close() # (writes the gzip trailer, doesn't close raw)
+            self.raw.flush()
+            if hasattr(os,"fsync"): os.fsync(self.raw.fileno())
+            self.raw.close()
+            if self.compressLater: # no gzip module
+                if os.system('gzip -%d < "%s" > "%s"' % (compress_progress_level,self.tmp,self.tmp+"z")): raise IOError("gzip failed")
+                os.remove(self.tmp) ; os.rename(self.tmp+"z",self.tmp)
+            if paranoid_file_management:
+                write(self.fname,read(self.tmp)) ; os.remove(self.tmp)
+            elif hasattr(os,"replace"): os.replace(self.tmp,self.fname)
+            else:
+                if not unix and fileExists(self.fname): os.remove(self.fname) # (os.rename won't overwrite on Windows)
+                os.rename(self.tmp,self.fname)
+            self.tmp = None ; ok = 1
+        finally:
+            if not ok: self.abort()
+    def abort(self):
+        # Removes the temporary file without touching fname
+        if not self.tmp: return
+        try: self.raw.close()
+        except: pass
+        for f in [self.tmp,self.tmp+"z"]:
+            try: os.remove(f)
+            except: pass
+        self.tmp = None
+    def __del__(self):
+        try: self.abort()
+        except: pass # (os may already have gone at exit)
 try:
     import gc
     gc.disable() # slight speedup (assume gradint won't create reference loops)
@@ -28,6 +28,7 @@ if sys.version_info[0]>2:
     def filter(*args): return list(_filter(*args))
     from functools import cmp_to_key
     def sort(l,c): l.sort(key=cmp_to_key(c))
+    def sortByKey(l,k): l.sort(key=k)
     raw_input,unichr,xrange,long = input,chr,range,int
     def chr(x): return unichr(x).encode('latin1')
     from subprocess import getoutput
@@ -35,6 +36,12 @@ if sys.version_info[0]>2:
     def unicode(b,enc): return b.decode(enc)
 else: # Python 2
     def sort(l,c): l.sort(c)
+    if sys.version_info[:2] >= (2,4):
+        def sortByKey(l,k): l.sort(key=k)
+    else: # no key= (decorate-sort-undecorate, with the index to keep it stable)
+        def sortByKey(l,k):
+            d = map(lambda x,i,k=k:(k(x),i,x),l,range(len(l))) ; d.sort()
+            l[:] = map(lambda x:x[2],d)
     popenRB,popenWB = "rb","wb"
     bytes = str
     try: from commands import getoutput
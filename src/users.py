@@ -21,6 +21,7 @@ def addUserToFname(fname,userNo):
 
 def select_userNumber(N,updateGUI=1):
   global samplesDirectory,vocabFile,progressFile,progressFileBackup,pickledProgressFile,settingsFile
+  wait_for_preplan() # (it uses these)
   prevUser = samplesDirectory
   samplesDirectory,vocabFile,progressFile,progressFileBackup,pickledProgressFile,settingsFile = user0
   samplesDirectory=addUserToFname(samplesDirectory,N)